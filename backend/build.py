@@ -0,0 +1,41 @@
+"""
+Run the analytics pipeline offline and write every served frame to a versioned snapshot bundle.
+
+    python build.py [--output DIR] [--keep N]
+
+Each run writes the next version of the bundle (frames as NumPy files plus a manifest with the
+version, source workbooks and stage timings) and then points the bundle to it. An API started
+with READ_ONLY=1 maps the bundle in BUNDLE_DIR instead of running the pipeline.
+"""
+import argparse
+import logging
+import sys
+import time
+import warnings
+from snapshot import build_snapshot, snapshot_metadata
+from snapshot_store import SnapshotStore
+from constants import BUNDLE_DIR
+
+# Create a logger object
+logger = logging.getLogger('uvicorn.error')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the data snapshot bundle served by the API in read-only mode.")
+    parser.add_argument("--output", default=BUNDLE_DIR, help=f"bundle directory (default: {BUNDLE_DIR})")
+    parser.add_argument("--keep", type=int, default=3, help="versions kept in the bundle, the new one included (default: 3)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # Same as the API: the model fits warn a lot (they run in this process with FORECAST_WORKERS=1
+    # and FORECAST_BUDGET=0)
+    warnings.filterwarnings('ignore')
+
+    store = SnapshotStore(args.output, keep=max(args.keep, 1))
+    version = (store.current_version() or 0) + 1
+    started = time.time()
+    snapshot = build_snapshot(version)
+    store.publish(version, snapshot_metadata(snapshot), snapshot.frames())
+    logger.info(f"Snapshot bundle v{version} written to {args.output} in {time.time() - started:.1f}s.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
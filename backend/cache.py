@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from constants import CACHE_DIR
+
+# Create a logger object
+logger = logging.getLogger('uvicorn.error')
+
+MANIFEST_FILE = os.path.join(CACHE_DIR, "manifest.json")
+# Versión del contenido de las hojas en caché; se incrementa al cambiar una función `derivar`
+CACHE_FORMAT = 1
+
+def _leer_manifiesto():
+    try:
+        with open(MANIFEST_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _guardar_manifiesto(manifiesto):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifiesto, f, indent=2)
+    os.replace(tmp, MANIFEST_FILE)
+
+def _hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def huella_archivo(ruta):
+    """
+    Devuelve el hash de contenido del archivo. Solo se vuelve a calcular cuando
+    cambian la ruta, el tamaño o la fecha de modificación registrados en el manifiesto.
+    """
+    ruta = os.path.abspath(ruta)
+    stat = os.stat(ruta)
+    manifiesto = _leer_manifiesto()
+    entrada = manifiesto.get(ruta)
+    if entrada and entrada["size"] == stat.st_size and entrada["mtime_ns"] == stat.st_mtime_ns:
+        return entrada["sha256"]
+
+    sha256 = _hash_archivo(ruta)
+    manifiesto[ruta] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+    try:
+        _guardar_manifiesto(manifiesto)
+    except OSError as e:
+        logger.warning(f"No se pudo actualizar el manifiesto de caché: {e}")
+    return sha256
+
+def _esquema(opciones):
+    # Cambia con las columnas leídas, la función `derivar` o CACHE_FORMAT
+    derivar = opciones.get('derivar')
+    partes = [CACHE_FORMAT, opciones.get('columnas'), derivar.__qualname__ if derivar is not None else None]
+    return hashlib.sha256(json.dumps(partes, default=str).encode()).hexdigest()[:8]
+
+def _ruta_cache(ruta, sheet_name, huella, opciones):
+    base = os.path.splitext(os.path.basename(ruta))[0]
+    return os.path.join(CACHE_DIR, f"{base}.{sheet_name}.{huella[:16]}.{_esquema(opciones)}.parquet")
+
+def _escribir_cache(archivo_cache, df):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = archivo_cache + ".tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, archivo_cache)
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo escribir la caché {archivo_cache}: {e}")
+        return False
+
+def _limpiar_versiones_anteriores(archivo_cache):
+    # Eliminar las versiones anteriores de la misma hoja (otro contenido del libro u otro esquema)
+    prefijo = os.path.basename(archivo_cache).rsplit(".", 3)[0] + "."
+    for nombre in os.listdir(CACHE_DIR):
+        ruta_vieja = os.path.join(CACHE_DIR, nombre)
+        if nombre.startswith(prefijo) and nombre.endswith(".parquet") and ruta_vieja != archivo_cache:
+            try:
+                os.remove(ruta_vieja)
+            except OSError:
+                pass
+
+def leer_libro_cache(ruta, hojas):
+    """
+    Lee varias hojas de un libro de Excel pasando por la caché columnar (Parquet).
+
+    `hojas` es un diccionario {hoja: {'columnas': [...], 'derivar': funcion}}. Las hojas
+    que no están en caché se leen abriendo el libro una sola vez. La caché se identifica
+    por la ruta, el tamaño, la fecha de modificación y el hash del contenido del libro, y
+    por el esquema de la hoja (columnas, `derivar` y CACHE_FORMAT); `derivar` se aplica antes
+    de guardar, de modo que las columnas calculadas (fecha, mes_año) también quedan en la caché.
+    """
+    try:
+        huella = huella_archivo(ruta)
+    except OSError:
+        huella = None
+
+    resultado = {}
+    pendientes = []
+    for hoja in hojas:
+        archivo_cache = _ruta_cache(ruta, hoja, huella, hojas[hoja]) if huella else None
+        if archivo_cache and os.path.exists(archivo_cache):
+            try:
+                resultado[hoja] = pd.read_parquet(archivo_cache)
+                continue
+            except Exception as e:
+                logger.warning(f"Caché ilegible {archivo_cache}, se vuelve a leer el Excel: {e}")
+        pendientes.append(hoja)
+
+    if pendientes:
+        # Un solo paso sobre el libro; el lector de openpyxl lo abre en modo read_only
+        with pd.ExcelFile(ruta, engine="openpyxl") as libro:
+            for hoja in pendientes:
+                opciones = hojas[hoja]
+                df = libro.parse(sheet_name=hoja, usecols=opciones.get('columnas'))
+                if opciones.get('derivar') is not None:
+                    df = opciones['derivar'](df)
+                if huella:
+                    archivo_cache = _ruta_cache(ruta, hoja, huella, opciones)
+                    if _escribir_cache(archivo_cache, df):
+                        _limpiar_versiones_anteriores(archivo_cache)
+                resultado[hoja] = df
+
+    return resultado
+
+def leer_excel_cache(ruta, sheet_name=0, columnas=None, derivar=None):
+    """
+    Lee una sola hoja de Excel pasando por la caché columnar (ver `leer_libro_cache`).
+    """
+    return leer_libro_cache(ruta, {sheet_name: {'columnas': columnas, 'derivar': derivar}})[sheet_name]
+
+ARCHIVO_PRONOSTICOS = os.path.join(CACHE_DIR, "pronosticos.parquet")
+
+def huella_serie(*partes):
+    """
+    Hash de una serie de entrenamiento: combina los arreglos numéricos y la configuración
+    de los modelos, de modo que cualquier cambio en alguno obliga a reajustar.
+    """
+    h = hashlib.sha256()
+    for parte in partes:
+        if isinstance(parte, np.ndarray):
+            h.update(str(parte.dtype).encode())
+            h.update(np.ascontiguousarray(parte).tobytes())
+        else:
+            h.update(json.dumps(parte, sort_keys=True, default=str).encode())
+        h.update(b"|")
+    return h.hexdigest()
+
+def leer_cache_pronosticos():
+    """
+    Devuelve {sku: {'huella', 'mejor_modelo', 'mae', 'predicciones', 'evaluaciones'}}
+    con los resultados guardados del último ajuste.
+    """
+    if not os.path.exists(ARCHIVO_PRONOSTICOS):
+        return {}
+    try:
+        df = pd.read_parquet(ARCHIVO_PRONOSTICOS)
+    except Exception as e:
+        logger.warning(f"Caché de pronósticos ilegible, se reajustan todos los SKUs: {e}")
+        return {}
+
+    entradas = {}
+    for fila in df.itertuples(index=False):
+        entradas[fila.sku] = {
+            'huella': fila.huella,
+            'mejor_modelo': fila.mejor_modelo,
+            'mae': None if pd.isna(fila.mae) else float(fila.mae),
+            'predicciones': None if fila.predicciones is None else np.asarray(fila.predicciones, dtype=float),
+            'evaluaciones': [tuple(e) for e in json.loads(fila.evaluaciones)],
+        }
+    return entradas
+
+def guardar_cache_pronosticos(entradas):
+    """
+    Guarda los resultados de ajuste por SKU (ver `leer_cache_pronosticos`).
+    """
+    df = pd.DataFrame({
+        'sku': list(entradas.keys()),
+        'huella': [e['huella'] for e in entradas.values()],
+        'mejor_modelo': [e['mejor_modelo'] for e in entradas.values()],
+        'mae': [e['mae'] for e in entradas.values()],
+        'predicciones': [None if e['predicciones'] is None else list(map(float, e['predicciones'])) for e in entradas.values()],
+        'evaluaciones': [json.dumps([[n, float(m)] for n, m in e['evaluaciones']]) for e in entradas.values()],
+    })
+    _escribir_cache(ARCHIVO_PRONOSTICOS, df)
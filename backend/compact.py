@@ -0,0 +1,104 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+# String key columns stored as categoricals; frames of one snapshot share each dictionary
+CATEGORY_COLUMNS = (
+    "sku", "bodega", "tipo", "politica", "clase_abc", "variabilidad",
+    "estacionalidad", "tendencia", "mejor_modelo",
+)
+
+def _downcast(values):
+    # Smallest dtype that keeps every value exactly
+    if values.dtype.kind in "iu":
+        return pd.to_numeric(values, downcast="integer" if values.dtype.kind == "i" else "unsigned")
+    if values.dtype == np.float64:
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+            return narrow
+    return values
+
+class FrameCompactor:
+    """
+    Rewrites the frames of one snapshot in a compact layout:
+
+    - key string columns become categoricals that share one dictionary per column name,
+    - numeric columns are downcast only when the narrower dtype is lossless,
+    - columns with identical content in several frames point to the same array.
+
+    Values are unchanged, so the frames can be served as they were.
+    """
+
+    def __init__(self, category_columns=CATEGORY_COLUMNS):
+        self.category_columns = category_columns
+        self._dtypes = {}
+        self._arrays = {}
+
+    def _category_dtype(self, name, values):
+        dtype = self._dtypes.get(name)
+        present = pd.unique(values[pd.notna(values)])
+        if dtype is None or not pd.Index(present).isin(dtype.categories).all():
+            known = [] if dtype is None else list(dtype.categories)
+            dtype = pd.CategoricalDtype(sorted(set(known) | set(present)))
+            self._dtypes[name] = dtype
+        return dtype
+
+    def _shared(self, array):
+        # Reuse an array with the same dtype and content from a frame compacted before
+        array = np.ascontiguousarray(array)
+        key = (array.dtype.str, array.shape, hashlib.blake2b(array.view(np.uint8), digest_size=16).digest())
+        return self._arrays.setdefault(key, array)
+
+    def compact(self, df):
+        columns = {}
+        for name in df.columns:
+            values = df[name]
+            if name in self.category_columns and (values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype)):
+                values = np.asarray(values, dtype=object)
+                dtype = self._category_dtype(name, values)
+                codes = pd.Categorical(values, dtype=dtype).codes
+                columns[name] = pd.Categorical.from_codes(self._shared(codes), dtype=dtype)
+            elif values.dtype.kind in "iuf":
+                columns[name] = self._shared(_downcast(values.to_numpy()))
+            else:
+                columns[name] = values.array
+        # copy=False keeps one block per column, so the shared arrays are not copied
+        return pd.DataFrame(columns, index=df.index, copy=False)
+
+def frame_memory(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def _column_parts(frame_name, column, series):
+    # (key, bytes) of the buffers behind a column; shared buffers get the same key
+    values = series.array
+    if isinstance(values, pd.Categorical):
+        codes = values.codes
+        return [
+            (("array", codes.__array_interface__["data"][0], codes.nbytes), codes.nbytes),
+            (("categories", id(values.categories)), int(values.categories.memory_usage(deep=True))),
+        ]
+    if series.dtype.kind in "biuf":
+        data = series.to_numpy()
+        return [(("array", data.__array_interface__["data"][0], data.nbytes), data.nbytes)]
+    return [(("column", frame_name, column), int(series.memory_usage(index=False, deep=True)))]
+
+def memory_report(frames, bytes_before=None):
+    """
+    Bytes used by each frame and in total; the total counts the buffers shared between frames once.
+    `bytes_before` optionally gives the size of each frame before it was compacted.
+    """
+    report = {}
+    buffers = {}
+    for name, df in frames.items():
+        if df is None:
+            continue
+        report[name] = {"rows": len(df), "columns": len(df.columns), "bytes": frame_memory(df)}
+        if bytes_before and name in bytes_before:
+            report[name]["bytes_before"] = bytes_before[name]
+        buffers[("index", name)] = int(df.index.memory_usage(deep=True))
+        for column in df.columns:
+            buffers.update(_column_parts(name, column, df[column]))
+    total = {"bytes": sum(buffers.values())}
+    if bytes_before:
+        total["bytes_before"] = sum(bytes_before.get(name, 0) for name in report)
+    return {"frames": report, "total": total}
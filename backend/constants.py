@@ -25,3 +25,74 @@ MONTHS = {
 CURRENT_YEAR = 2024 # For testing purposes, set to a fixed year
 
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000")
+
+# Directory for the columnar (Parquet) snapshots of the Excel inputs
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+# Number of processes used to fit the forecasting models (1 fits in the API process when
+# FORECAST_BUDGET is 0; with a budget one pool process is used so it can be stopped)
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", os.cpu_count() or 1))
+
+# Reuse the stored forecast of SKUs whose series did not change ("0" refits everything)
+FORECAST_CACHE = os.getenv("FORECAST_CACHE", "1") == "1"
+
+# Model selection mode: "completo" fits every model for every SKU, "escalonado" scores
+# cheap baselines first and only fits Holt-Winters/ARIMA/SARIMA for the SKUs that need it
+FORECAST_SELECTION = os.getenv("FORECAST_SELECTION", "completo")
+
+# Minimum training months before a SKU can be escalated to the seasonal models
+FORECAST_MIN_HISTORY = int(os.getenv("FORECAST_MIN_HISTORY", 24))
+
+# Baseline MAE, relative to the mean test consumption, above which a SKU is escalated
+FORECAST_ESCALATION_THRESHOLD = float(os.getenv("FORECAST_ESCALATION_THRESHOLD", 0.2))
+
+# Time limits in seconds for the model fits (0 disables each limit): a single model,
+# all the models of one SKU, and the whole forecasting stage
+FORECAST_MODEL_TIMEOUT = float(os.getenv("FORECAST_MODEL_TIMEOUT", 30))
+FORECAST_SKU_TIMEOUT = float(os.getenv("FORECAST_SKU_TIMEOUT", 90))
+FORECAST_BUDGET = float(os.getenv("FORECAST_BUDGET", 1800))
+
+# Inventory policy parameters (costs per TM, service level and z-score per ABC class)
+INVENTORY_POLICY = {
+    "costo_mantener": float(os.getenv("COSTO_MANTENER", 1.84)),  # Costo de mantener (por TM)
+    "costo_recibir": float(os.getenv("COSTO_RECIBIR", 0.36)),  # Costo de recibir (por TM)
+    "costo_pedir": float(os.getenv("COSTO_PEDIR", 7.50)),  # Costo fijo de pedir
+    "tasa_almacenamiento": float(os.getenv("TASA_ALMACENAMIENTO", 0.12)),  # Fracción anual para h
+    "periodo_revision": float(os.getenv("PERIODO_REVISION", 5)),  # T para Revisión Periódica
+    "costo_defecto": 100,  # Costo cuando el SKU no está en costo_mp
+    "lead_time_defecto": 30,  # Lead time cuando el SKU no está en lt
+    "nivel_servicio": {'A': 0.95, 'B': 0.75, 'C': 0.70},
+    "z_values": {'A': 1.645, 'B': 0.675, 'C': 0.524},
+}
+
+# Maximum cumulative consumption percentage for the A and B classes (the rest is C)
+ABC_LIMITS = (float(os.getenv("ABC_LIMIT_A", 80)), float(os.getenv("ABC_LIMIT_B", 95)))
+
+# Seconds between checks for changes in the source workbooks (0 disables the automatic reload)
+RELOAD_INTERVAL = float(os.getenv("RELOAD_INTERVAL", 60))
+
+# Memory bound in MB of the response cache of the chart and table endpoints (0 disables it)
+RESPONSE_CACHE_MB = float(os.getenv("RESPONSE_CACHE_MB", 64))
+
+# Store the served frames with categorical keys, lossless downcasts and shared columns ("0" keeps the pandas defaults)
+COMPACT_FRAMES = os.getenv("COMPACT_FRAMES", "1") == "1"
+
+# Rows materialized per chunk by the streaming table export
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 5000))
+
+# Share one snapshot between uvicorn workers: one worker builds it into SNAPSHOT_DIR and every
+# worker maps the files read-only, checking for new versions every SNAPSHOT_POLL_INTERVAL seconds
+SHARED_SNAPSHOT = os.getenv("SHARED_SNAPSHOT", "0") == "1"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(CACHE_DIR, "snapshot"))
+SNAPSHOT_POLL_INTERVAL = float(os.getenv("SNAPSHOT_POLL_INTERVAL", 1))
+
+# Directory of the snapshot bundle written by `python build.py`; with READ_ONLY=1 the API only
+# serves that bundle (following the new versions written there) and never runs the pipeline
+BUNDLE_DIR = os.getenv("BUNDLE_DIR", "bundle")
+READ_ONLY = os.getenv("READ_ONLY", "0") == "1"
+
+# Seconds allowed for importing the API modules; startup logs a warning when they take longer
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", 1.5))
+
+# Pipeline tasks run at the same time while building a snapshot (0 runs every ready task at once, 1 runs them one by one)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 0))
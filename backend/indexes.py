@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+class FrameIndex:
+    """
+    Inverted indexes of a frame: for each indexed column, the sorted row positions of every value.
+
+    A multi-valued filter is the union of the position lists of its values and several filters
+    are intersected, so a request never scans the full columns with `isin`.
+    """
+
+    def __init__(self, columns):
+        # columns: {name: values}, one value per row of the frame
+        self._columns = {}
+        for name, values in columns.items():
+            codes, uniques = pd.factorize(np.asarray(values))
+            order = np.argsort(codes, kind="stable")
+            # Rows with nulls (code -1) sort first and are not indexed
+            order = order[codes[order] >= 0]
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)))))
+            lookup = {value: code for code, value in enumerate(uniques.tolist())}
+            self._columns[name] = (codes, uniques, order, offsets, lookup)
+
+    @classmethod
+    def from_frame(cls, df, spec):
+        # spec: {name: column or function of the frame that returns the values}
+        return cls({name: source(df) if callable(source) else df[source] for name, source in spec.items()})
+
+    def positions(self, name, values):
+        """
+        Sorted row positions whose `name` is any of `values`.
+        """
+        _, _, order, offsets, lookup = self._columns[name]
+        codes = sorted({lookup[value] for value in values if value in lookup})
+        if not codes:
+            return EMPTY
+        if len(codes) == 1:
+            return order[offsets[codes[0]]:offsets[codes[0] + 1]]
+        return np.sort(np.concatenate([order[offsets[code]:offsets[code + 1]] for code in codes]))
+
+    def select(self, **filters):
+        """
+        Row positions that match every non-empty filter, or None when no filter applies.
+        """
+        result = None
+        for name, values in filters.items():
+            if not values:
+                continue
+            positions = self.positions(name, values)
+            result = positions if result is None else np.intersect1d(result, positions, assume_unique=True)
+        return result
+
+    def filter(self, df, **filters):
+        positions = self.select(**filters)
+        return df if positions is None else df.iloc[positions]
+
+    def values(self, name, positions=None):
+        """
+        Distinct values of `name` in order of first appearance, optionally within `positions`.
+        """
+        codes, uniques, _, _, _ = self._columns[name]
+        if positions is None:
+            return uniques.tolist()
+        codes = codes[positions]
+        return uniques[pd.unique(codes[codes >= 0])].tolist()
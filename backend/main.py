@@ -1,14 +1,29 @@
-from fastapi import FastAPI, Query
+import time
+# Measured from the first import so the cold start cost of the API modules is known
+IMPORT_STARTED = time.perf_counter()
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 import logging
-import threading
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
+from starlette.routing import Match
+import numpy as np
 from typing import List, Optional
-from utils import cargar_datos_1, cargar_datos_2, cargar_datos_3, cargar_datos_4, cargar_datos_5, cargar_datos_6
-from constants import CURRENT_YEAR, ALLOWED_ORIGINS
+from snapshot import STAGES, SnapshotManager
+from snapshot_store import SnapshotStore
+from compact import memory_report
+from payloads import build_series
+from tables import EXPORT_FORMATS, export_table, query_table
+from response_cache import ResponseCache, normalize_query
+from metrics import CONTENT_TYPE, SIZE_BUCKETS, Gauge, Registry, snapshot_metrics
+from constants import (
+    CURRENT_YEAR, ALLOWED_ORIGINS, RELOAD_INTERVAL, RESPONSE_CACHE_MB, EXPORT_CHUNK_ROWS,
+    SHARED_SNAPSHOT, SNAPSHOT_DIR, SNAPSHOT_POLL_INTERVAL, BUNDLE_DIR, READ_ONLY, IMPORT_TIME_BUDGET,
+)
 import warnings
 warnings.filterwarnings('ignore')
 
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
 # Create a logger object
 logger = logging.getLogger('uvicorn.error')
 
@@ -18,7 +33,57 @@ app = FastAPI()
 # Parsing the allowed origins from the environment variable
 allowed_origins = [origin.strip() for origin in ALLOWED_ORIGINS.split(",") if origin.strip()]
 
-# Add CORS middleware
+# Holds the current data snapshot and rebuilds it when the workbooks change.
+# With SHARED_SNAPSHOT one worker builds it and every uvicorn worker maps the same files;
+# with READ_ONLY every worker maps the bundle written by build.py.
+if READ_ONLY:
+    snapshots = SnapshotManager(SnapshotStore(BUNDLE_DIR), read_only=True)
+else:
+    snapshots = SnapshotManager(SnapshotStore(SNAPSHOT_DIR) if SHARED_SNAPSHOT else None)
+
+def get_snapshot(stage):
+    # Read the reference once per request: every frame used by the request comes from the same version
+    snapshot = snapshots.current
+    if snapshot is None or not snapshot.has_stage(stage):
+        raise HTTPException(
+            status_code=503,
+            detail={"message": f"Data for stage '{stage}' is still loading", "stage": stage, "progress": snapshots.building, "error": snapshots.last_error},
+            headers={"Retry-After": "5"},
+        )
+    return snapshot
+
+# Serialized responses of the chart and table endpoints for the current snapshot version
+response_cache = ResponseCache(int(RESPONSE_CACHE_MB * 1024 * 1024))
+CACHED_PREFIXES = ("/api/line-chart", "/api/pie-chart", "/api/table")
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    return if_none_match is not None and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")])
+
+@app.middleware("http")
+async def cache_responses(request: Request, call_next):
+    snapshot = snapshots.current
+    if request.method != "GET" or snapshot is None or response_cache.max_bytes <= 0 or not request.url.path.startswith(CACHED_PREFIXES):
+        return await call_next(request)
+
+    key = (request.url.path, normalize_query(request.query_params))
+    entry = response_cache.get(snapshot.version, key)
+    if entry is None:
+        response = await call_next(request)
+        # Only successful responses are cached; 503 while a stage is loading is retried
+        if response.status_code != 200:
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        entry = response_cache.put(snapshot.version, key, body, response.headers.get("content-type"))
+
+    body, media_type, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+# Add CORS middleware. It is added after cache_responses so it wraps it: cached and 304
+# responses get the CORS headers of each request
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins, # Frontend origin
@@ -27,176 +92,189 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-data_loaded = False
-
-def ensure_data_loaded():
-    global data_loaded
-    if not data_loaded:
-        print("INFO:     Starting loading data.")
-        global df_mensual, df_semanal, df_analizado, df_ultimos_6, summary
-        global conteo_modelo_bodega, df_abc, df_conteos, df_unido
-        global df_periodico, df_EOQ, df_solicitar, conteo_politica_bodega
-
-        df_mensual = cargar_datos_1()
-        df_semanal = cargar_datos_2(field='week')
-        df_analizado, df_ultimos_6, summary, conteo_modelo_bodega = cargar_datos_3(df_mensual)
-        df_abc, df_conteos = cargar_datos_4(df_analizado)
-        df_unido = cargar_datos_5(df_ultimos_6, df_abc, summary)
-        df_periodico, df_EOQ, df_solicitar, conteo_politica_bodega = cargar_datos_6(df_unido)
-
-        data_loaded = True
-        print("INFO:     Finished loading data.")
+# Metrics of this worker process, exposed on /metrics in the Prometheus text format
+metrics = Registry()
+request_count = metrics.counter("mochasa_http_requests_total", "HTTP requests by endpoint and status.", ("method", "endpoint", "status"))
+request_latency = metrics.histogram("mochasa_http_request_duration_seconds", "Time to serve each HTTP request, until the last byte of the body.", ("method", "endpoint"))
+response_size = metrics.histogram("mochasa_http_response_size_bytes", "Size of the HTTP response bodies.", ("method", "endpoint"), SIZE_BUCKETS)
+
+def state_metrics():
+    import_seconds = Gauge("mochasa_import_seconds", "Time spent importing the API modules at startup.")
+    import_seconds.set(round(IMPORT_SECONDS, 4))
+    reloading = Gauge("mochasa_snapshot_reloading", "1 while a new data snapshot is being built.")
+    reloading.set(int(snapshots.reloading))
+    failed = Gauge("mochasa_snapshot_last_build_failed", "1 if the last snapshot build failed.")
+    failed.set(int(snapshots.last_error is not None))
+    cache = Gauge("mochasa_response_cache", "Response cache entries, bytes, hits and misses.", ("stat",))
+    for name, value in response_cache.stats().items():
+        cache.set(value, stat=name)
+    return [import_seconds, reloading, failed, cache, *snapshot_metrics(snapshots.current)]
+
+metrics.add_collector(state_metrics)
+
+def endpoint_label(request):
+    # Route template of the request (e.g. /api/export/{table}), so each endpoint is one series
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_requests(request: Request, call_next):
+    started = time.perf_counter()
+    labels = {"method": request.method, "endpoint": endpoint_label(request)}
+    response = await call_next(request)
+    request_count.inc(status=response.status_code, **labels)
+
+    def observe(size):
+        request_latency.observe(time.perf_counter() - started, **labels)
+        response_size.observe(size, **labels)
+
+    length = response.headers.get("content-length")
+    if length is not None:
+        observe(int(length))
+        return response
+
+    # Streamed bodies (the table exports) are measured when their last chunk is sent
+    body = response.body_iterator
+    async def measured_body():
+        size = 0
+        async for chunk in body:
+            size += len(chunk)
+            yield chunk
+        observe(size)
+    response.body_iterator = measured_body()
+    return response
 
 @app.on_event("startup")
 def startup_event():    
-    # Run load data in a separate thread to avoid blocking startup
-    threading.Thread(target=ensure_data_loaded).start()
+    if IMPORT_SECONDS > IMPORT_TIME_BUDGET:
+        logger.warning(f"API modules imported in {IMPORT_SECONDS:.2f}s, over the {IMPORT_TIME_BUDGET:.2f}s budget.")
+    else:
+        logger.info(f"API modules imported in {IMPORT_SECONDS:.2f}s.")
+    # Load data in a background thread to avoid blocking startup, then
+    # rebuild the snapshot in the background when the source workbooks change
+    snapshots.start(RELOAD_INTERVAL, SNAPSHOT_POLL_INTERVAL)
 
 @app.get("/health")
 def health():
-    if not data_loaded:
-        return {"status": "initializing"}
-    return {"status": "ok"}
+    snapshot = snapshots.current
+    stages = {
+        stage: {"ready": snapshot is not None and snapshot.has_stage(stage), "seconds": snapshot.timings.get(stage) if snapshot else None}
+        for stage in STAGES
+    }
+    if snapshot is None or not snapshot.complete:
+        return {"status": "initializing", "stages": stages, "progress": snapshots.building, "error": snapshots.last_error}
+    return {
+        "status": "ok",
+        "version": snapshot.version,
+        "loaded_at": snapshot.created_at,
+        "stages": stages,
+        "pipeline": {"tasks": snapshot.tasks, "critical_path": snapshot.critical_path},
+        "reloading": snapshots.reloading,
+        "read_only": snapshots.read_only,
+        "response_cache": response_cache.stats(),
+        "progress": snapshots.building,
+        "error": snapshots.last_error,
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+@app.get("/health/memory")
+def memory():
+    # Bytes per served frame, before and after compaction; the total counts shared buffers once
+    snapshot = get_snapshot("aggregates")
+    return memory_report(snapshot.frames(), snapshot.bytes_before)
+
+@app.post("/api/reload")
+def reload_data():
+    # Build the next snapshot in the background; requests keep using the current one meanwhile
+    if snapshots.read_only:
+        return JSONResponse(status_code=409, content={"status": "read-only", "detail": "Data is updated by writing a new bundle with build.py"})
+    if not snapshots.reload_in_background():
+        return JSONResponse(status_code=409, content={"status": "already reloading"})
+    return JSONResponse(status_code=202, content={"status": "reloading"})
+
+def series_names(chart_data, level):
+    # Name of the chart series of each row for the rollup level
+    if level == "total":
+        return np.full(len(chart_data), "Total", dtype=object)
+    return chart_data[level]
 
 @app.get("/api/line-chart-1")
 def get_line_chart_1(
     year: Optional[List[int]] = Query(None, alias="anio"),  # Filter by year
     sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
+    level: str = Query("sku", pattern="^(sku|bodega|total)$"),  # One series per sku, per bodega or a single total
 ):
-    # Apply filters based on query parameters
-    filtered_df = df_mensual
-    
-    # Filter by year if specified
-    if year:
-        filtered_df = filtered_df[filtered_df['mes_año'].dt.year.isin(year)]
-    
-    # Filter by sku if specified (allow multiple selections)
-    if sku:
-        filtered_df = filtered_df[filtered_df['sku'].isin(sku)]
+    snap = get_snapshot("aggregates")
+    # Look up the monthly totals of the requested level in the rollup cube
+    chart_data = snap.rollups['monthly'].query(level, year=year, sku=sku, bodega=bodega)
 
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]    
-    
-    # Group the filtered data by 'mes_año', 'sku', and 'bodega' and sum 'consumo_tm'
-    chart_data = filtered_df.groupby(['mes_año', 'sku', 'bodega'])['consumo_tm'].sum().reset_index()
+    # Prepare the response format: one series per SKU, bodega or the total, built in a single pass
+    series = build_series(series_names(chart_data, level), chart_data['mes_año'].dt.strftime('%Y-%m'), chart_data['consumo_tm'])
+    response_data = [{"name": name, "data": points} for name, points in series]
 
-    # Prepare the response format
-    response_data = []
-    for sku_value in chart_data['sku'].unique():
-        sku_data = chart_data[chart_data['sku'] == sku_value]
-        sku_data_dict = {
-            "name": sku_value, # sku
-            "data": [ # values
-                {"x": row["mes_año"].strftime('%Y-%m'), "y": round(row["consumo_tm"], 2)}
-                for _, row in sku_data.iterrows()
-            ]
-        }
-        response_data.append(sku_data_dict)
-
-    return {"data": response_data}
+    return ORJSONResponse({"data": response_data})
 
 @app.get("/api/line-chart-2")
 def get_line_chart_2(
     year: Optional[List[int]] = Query(None, alias="anio"),  # Filter by year
     sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
+    level: str = Query("sku", pattern="^(sku|bodega|total)$"),  # One series per sku, per bodega or a single total
 ):
-    # Apply filters based on query parameters
-    filtered_df = df_semanal
-
-    # Filter by year if specified
-    if year:
-        filtered_df = filtered_df[filtered_df['anio'].isin(year)]
-
-    # Filter by sku if specified (allow multiple selections)
-    if sku:
-        filtered_df = filtered_df[filtered_df['sku'].isin(sku)]
+    snap = get_snapshot("aggregates")
+    # Look up the weekly totals of the requested level in the rollup cube
+    chart_data = snap.rollups['weekly'].query(level, year=year, sku=sku, bodega=bodega)
 
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]    
-
-    # Group the filtered data by 'mes_año', 'sku', and 'bodega' and sum 'consumo_tm'
-    chart_data = filtered_df.groupby(['semana', 'sku', 'bodega'])['consumo_tm'].sum().reset_index()
+    # Prepare the response format: one series per SKU, bodega or the total, built in a single pass
+    series = build_series(series_names(chart_data, level), chart_data['semana'], chart_data['consumo_tm'])
+    response_data = [{"name": name, "data": points} for name, points in series]
 
-    # Prepare the response format
-    response_data = []
-    for sku_value in chart_data['sku'].unique():
-        sku_data = chart_data[chart_data['sku'] == sku_value]
-        sku_data_dict = {
-            "name": sku_value, # sku
-            "data": [ # values
-                {"x": row["semana"], "y": round(row["consumo_tm"], 2)}
-                for _, row in sku_data.iterrows()
-            ]
-        }
-        response_data.append(sku_data_dict)
-
-    return {"data": response_data}
+    return ORJSONResponse({"data": response_data})
 
 @app.get("/api/line-chart-3")
 def get_line_chart_3(
     sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
 ):
+    snap = get_snapshot("forecasts")
     # Seleccionar los últimos 6 registros por SKU
-    filtered_df = df_ultimos_6
-    # Filter by current year
-    filtered_df = filtered_df[filtered_df['mes_año'].dt.year.isin([CURRENT_YEAR])] 
-    # Filter by sku if specified (allow multiple selections)
-    if sku:
-        filtered_df = filtered_df[filtered_df['sku'].isin(sku)]
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]
+    # Filter by current year, sku and bodega using the precomputed indexes
+    filtered_df = snap.indexes['df_ultimos_6'].filter(snap.df_ultimos_6, year=[CURRENT_YEAR], sku=sku, bodega=bodega)
     # Split into forecast and consumption data
     # forecast_df = filtered_df[filtered_df['tipo'] == 'pronostico']
     df_consumos = filtered_df[filtered_df['tipo'].isna()]
     # Convert the 'mes_año' column to a list
     last_mes_año = df_consumos['mes_año'].max() if not df_consumos.empty else None
     
+    consumo = filtered_df['consumo_tm'].fillna(0)
+    es_pronostico = (filtered_df['tipo'] == 'pronostico').to_numpy()
+    # The last consumption month is drawn in both lines so the forecast line is continuous
+    es_ultimo = ~es_pronostico & (filtered_df['mes_año'] == last_mes_año).to_numpy()
+    y_consumo = consumo.where(~es_pronostico)
+    y_pronostico = consumo.where(es_pronostico | es_ultimo)
+
+    series = build_series(filtered_df['sku'], filtered_df['mes_año'].dt.strftime('%Y-%m'), y_consumo, y_pronostico)
     response_data = []
-    for sku_value in filtered_df['sku'].unique():
-        sku_data = filtered_df[filtered_df['sku'] == sku_value]
-        default_dict = { # For standard consumption logic
-            "name": sku_value, # SKU name 
-            "type": "line",
-            "data": []
-        }
-        forecast_dict = {
-            "name": f"{sku_value} - FORECAST", # Adding forecast to SKU name
-            "type": "line",
-            "data": []
-        }
-        for _, row in sku_data.iterrows():
-            x_value =row["mes_año"].strftime('%Y-%m')
-            y_value = round(row["consumo_tm"] if pd.notna(row["consumo_tm"]) else 0, 2)
-            if row['tipo'] == 'pronostico': # For forecast data
-                # Pronostico logic: 'y' is None for forecast
-                default_dict['data'].append({ "x": x_value, "y": None })
-                forecast_dict['data'].append({ "x": x_value, "y": y_value })
-            elif row['mes_año'] == last_mes_año: # Last month logic (continuity)
-                # Copy the last value from filtered to forecast line
-                default_dict['data'].append({ "x": x_value, "y": y_value })
-                forecast_dict['data'].append({ "x": x_value, "y": y_value })
-            else: # For filtered logic
-                # Standard filtered data and forecast logicc
-                forecast_dict['data'].append({ "x": x_value, "y": None })
-                default_dict['data'].append({ "x": x_value, "y": y_value })
-        response_data.append(default_dict)
-        response_data.append(forecast_dict)
-
-    return {"data": response_data}
+    for sku_value, consumo_points, forecast_points in series:
+        response_data.append({"name": sku_value, "type": "line", "data": consumo_points})
+        response_data.append({"name": f"{sku_value} - FORECAST", "type": "line", "data": forecast_points})
+
+    return ORJSONResponse({"data": response_data})
 
 @app.get("/api/pie-chart-1")
 def get_pie_chart_1(bodega: Optional[List[str]] = Query(None)):
-    filtered_df = df_conteos
-    print(df_conteos)
+    snap = get_snapshot("abc")
+    filtered_df = snap.df_conteos
     if bodega:
         filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]    
-    # Example of what to send in the response (using df_conteos for simplicity)
+    # Example of what to send in the response (using snap.df_conteos for simplicity)
     # This assumes that you want to send the sum of 'consumo_ajustado' for each 'bodega'
     pie_data = {
         "labels": filtered_df['clase_abc'].tolist(),
@@ -208,10 +286,11 @@ def get_pie_chart_1(bodega: Optional[List[str]] = Query(None)):
 
 @app.get("/api/pie-chart-2")
 def get_pie_chart_2(bodega: Optional[List[str]] = Query(None)):
-    filtered_df = conteo_modelo_bodega
+    snap = get_snapshot("forecasts")
+    filtered_df = snap.conteo_modelo_bodega
     if bodega:
         filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]    
-    # Example of what to send in the response (using df_conteos for simplicity)
+    # Example of what to send in the response (using snap.df_conteos for simplicity)
     # This assumes that you want to send the sum of 'consumo_ajustado' for each 'bodega'
     pie_data = {
         "labels": filtered_df['mejor_modelo'].tolist(),
@@ -223,10 +302,11 @@ def get_pie_chart_2(bodega: Optional[List[str]] = Query(None)):
 
 @app.get("/api/pie-chart-3")
 def get_pie_chart_1(bodega: Optional[List[str]] = Query(None)):
-    filtered_df = conteo_politica_bodega
+    snap = get_snapshot("policies")
+    filtered_df = snap.conteo_politica_bodega
     if bodega:
         filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]    
-    # Example of what to send in the response (using df_conteos for simplicity)
+    # Example of what to send in the response (using snap.df_conteos for simplicity)
     # This assumes that you want to send the sum of 'consumo_ajustado' for each 'bodega'
     pie_data = {
         "labels": filtered_df['politica'].tolist(),
@@ -236,6 +316,46 @@ def get_pie_chart_1(bodega: Optional[List[str]] = Query(None)):
         "data": pie_data
     }
 
+# Source frame, filters and output layout of each table endpoint
+TABLES = {
+    "table-1": {
+        "stage": "abc", "frame": "df_abc", "filters": ("bodega", "clase_abc"),
+        "columns": ['sku', 'clase_abc', 'bodega'],
+    },
+    "table-2": {
+        "stage": "policies", "frame": "df_unido", "filters": ("sku", "bodega"),
+        "columns": ['sku', 'mean', 'std', 'clase_abc', 'bodega', 'variabilidad'],
+        "round_columns": ['mean', 'std'],
+    },
+    "table-3": {
+        "stage": "policies", "frame": "df_periodico", "filters": ("sku", "bodega"), "include_index": True,
+        "round_columns": ['mean', 'costo', 'h', 'demanda_anual', 'SS', 'nivel_objetivo'],
+    },
+    "table-4": {
+        "stage": "policies", "frame": "df_EOQ", "filters": ("sku", "bodega"), "include_index": True,
+        "round_columns": ['mean', 'costo', 'h', 'demanda_anual', 'R', 'EOQ'],
+    },
+    "table-5": {
+        "stage": "policies", "frame": "df_solicitar", "filters": ("sku", "bodega"), "include_index": True,
+        "round_columns": [
+            'mean', 'lead_time', 'SS', 'inventario', 'OCs', 'consumo_ult_sem',
+            'Consumo_ult_mes', 'inventario_total', 'solicitar', 'demanda_diaria_promedio',
+            'cobertura_dias', 'cobertura_meses'
+        ],
+    },
+}
+
+def table_source(snap, table):
+    # Frame, index and output layout arguments for query_table / export_table
+    spec = TABLES[table]
+    return {
+        "df": getattr(snap, spec["frame"]),
+        "index": snap.indexes[spec["frame"]],
+        "columns": spec.get("columns"),
+        "round_columns": spec.get("round_columns", ()),
+        "include_index": spec.get("include_index", False),
+    }
+
 @app.get("/api/table-1")
 def get_table_1(
     page: int = Query(1, ge=1),  # Page number, minimum 1
@@ -243,47 +363,22 @@ def get_table_1(
     disable_pagination: bool = Query(False),  # Option to disable pagination
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
     clase_abc: Optional[List[str]] = Query(None),  # Filter by clase_abc (default includes both)
-    ):
-    filtered_df = df_abc.reset_index()
-    filtered_df = filtered_df.fillna(0)
-    filtered_df = filtered_df[['sku', 'clase_abc', 'bodega']]
-
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]
-        # Filter by bodega if specified (allow multiple selections)
-
-    if clase_abc:
-        filtered_df = filtered_df[filtered_df['clase_abc'].isin(clase_abc)]
-        # Filter by bodega if specified (allow multiple selections)
-
-    # Total number of records
-    total_records = len(filtered_df)
-
-    filtered_df = filtered_df.to_dict(orient='records')
-
-    # If pagination is disabled, return all data
-    if disable_pagination:
-        return {
-            "data": filtered_df
-        }
-    
-    # Calculate pagination
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-    
-    # Slice the data for the current page
-    paginated_data = filtered_df[start_index:end_index]
-    
-    # Calculate total pages
-    total_pages = (total_records + page_size - 1) // page_size
-    
-    return {
-        "data": paginated_data,
-        "total": total_records,
-        "page": page,
-        "total_pages": total_pages
-    }
+    sort_by: Optional[str] = Query(None),  # Column to sort by
+    order: str = Query("asc", pattern="^(asc|desc)$"),  # Sort direction
+    cursor: Optional[str] = Query(None),  # Keyset pagination cursor (empty for the first page)
+):
+    snap = get_snapshot(TABLES["table-1"]["stage"])
+    # Filter, sort and slice on the columns; only the rows of the page are converted to records
+    return query_table(
+        **table_source(snap, "table-1"),
+        filters={'bodega': bodega, 'clase_abc': clase_abc},
+        page=page,
+        page_size=page_size,
+        disable_pagination=disable_pagination,
+        sort_by=sort_by,
+        descending=order == "desc",
+        cursor=cursor,
+    )
 
 @app.get("/api/table-2")
 def get_table_2(
@@ -292,49 +387,22 @@ def get_table_2(
     disable_pagination: bool = Query(False),  # Option to disable pagination
     sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
+    sort_by: Optional[str] = Query(None),  # Column to sort by
+    order: str = Query("asc", pattern="^(asc|desc)$"),  # Sort direction
+    cursor: Optional[str] = Query(None),  # Keyset pagination cursor (empty for the first page)
 ):
-    filtered_df = df_unido.reset_index()
-    filtered_df = filtered_df.fillna(0)
-    filtered_df = filtered_df[['sku', 'mean', 'std', 'clase_abc', 'bodega', 'variabilidad']]
-
-    # Filter by sku if specified (allow multiple selections)
-    if sku:
-        filtered_df = filtered_df[filtered_df['sku'].isin(sku)]
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]
-
-    # Round the numeric columns to 2 decimal places
-    filtered_df['mean'] = filtered_df['mean'].round(2)
-    filtered_df['std'] = filtered_df['std'].round(2)
-
-    # Total number of records
-    total_records = len(filtered_df)
-
-    filtered_df = filtered_df.to_dict(orient='records')
-
-    # If pagination is disabled, return all data
-    if disable_pagination:
-        return {
-            "data": filtered_df
-        }
-    
-    # Calculate pagination
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-    
-    # Slice the data for the current page
-    paginated_data = filtered_df[start_index:end_index]
-    
-    # Calculate total pages
-    total_pages = (total_records + page_size - 1) // page_size
-    
-    return {
-        "data": paginated_data,
-        "total": total_records,
-        "page": page,
-        "total_pages": total_pages
-    }
+    snap = get_snapshot(TABLES["table-2"]["stage"])
+    # Filter, sort and slice on the columns; only the rows of the page are converted to records
+    return query_table(
+        **table_source(snap, "table-2"),
+        filters={'sku': sku, 'bodega': bodega},
+        page=page,
+        page_size=page_size,
+        disable_pagination=disable_pagination,
+        sort_by=sort_by,
+        descending=order == "desc",
+        cursor=cursor,
+    )
 
 
 @app.get("/api/table-3")
@@ -344,50 +412,22 @@ def get_table_3(
     disable_pagination: bool = Query(False),  # Option to disable pagination
     sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
+    sort_by: Optional[str] = Query(None),  # Column to sort by
+    order: str = Query("asc", pattern="^(asc|desc)$"),  # Sort direction
+    cursor: Optional[str] = Query(None),  # Keyset pagination cursor (empty for the first page)
 ):
-    filtered_df = df_periodico.reset_index()
-    filtered_df = filtered_df.fillna(0)
-
-    # Filter by sku if specified (allow multiple selections)
-    if sku:
-        filtered_df = filtered_df[filtered_df['sku'].isin(sku)]
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]
-
-    # Total number of records
-    total_records = len(filtered_df)
-
-    # Apply rounding to relevant fields
-    columns_to_round = ['mean', 'costo', 'h', 'demanda_anual', 'SS', 'nivel_objetivo']
-    
-    for column in columns_to_round:
-        filtered_df[column] = filtered_df[column].round(2)
-    
-    filtered_df = filtered_df.to_dict(orient='records')
-
-    # If pagination is disabled, return all data
-    if disable_pagination:
-        return {
-            "data": filtered_df
-        }
-    
-    # Calculate pagination
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-    
-    # Slice the data for the current page
-    paginated_data = filtered_df[start_index:end_index]
-    
-    # Calculate total pages
-    total_pages = (total_records + page_size - 1) // page_size
-    
-    return {
-        "data": paginated_data,
-        "total": total_records,
-        "page": page,
-        "total_pages": total_pages
-    }
+    snap = get_snapshot(TABLES["table-3"]["stage"])
+    # Filter, sort and slice on the columns; only the rows of the page are converted to records
+    return query_table(
+        **table_source(snap, "table-3"),
+        filters={'sku': sku, 'bodega': bodega},
+        page=page,
+        page_size=page_size,
+        disable_pagination=disable_pagination,
+        sort_by=sort_by,
+        descending=order == "desc",
+        cursor=cursor,
+    )
 
 
 @app.get("/api/table-4")
@@ -397,52 +437,22 @@ def get_table_4(
     disable_pagination: bool = Query(False),  # Option to disable pagination
     sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
+    sort_by: Optional[str] = Query(None),  # Column to sort by
+    order: str = Query("asc", pattern="^(asc|desc)$"),  # Sort direction
+    cursor: Optional[str] = Query(None),  # Keyset pagination cursor (empty for the first page)
 ):
-    filtered_df = df_EOQ.reset_index()
-    filtered_df = filtered_df.fillna(0)
-
-    # Filter by sku if specified (allow multiple selections)
-    if sku:
-        filtered_df = filtered_df[filtered_df['sku'].isin(sku)]
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]
-
-    # Total number of records
-    total_records = len(filtered_df)
-
-    # Columns to round
-    columns_to_round = ['mean', 'costo', 'h', 'demanda_anual', 'R', 'EOQ']
-
-    # Apply rounding to each of the columns in the list
-    for column in columns_to_round:
-        filtered_df[column] = filtered_df[column].round(2)
-
-    # Convert the dataframe to a list of dictionaries
-    filtered_df = filtered_df.to_dict(orient='records')
-
-    # If pagination is disabled, return all data
-    if disable_pagination:
-        return {
-            "data": filtered_df
-        }
-
-    # Calculate pagination
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-
-    # Slice the data for the current page
-    paginated_data = filtered_df[start_index:end_index]
-
-    # Calculate total pages
-    total_pages = (total_records + page_size - 1) // page_size
-
-    return {
-        "data": paginated_data,
-        "total": total_records,
-        "page": page,
-        "total_pages": total_pages
-    }
+    snap = get_snapshot(TABLES["table-4"]["stage"])
+    # Filter, sort and slice on the columns; only the rows of the page are converted to records
+    return query_table(
+        **table_source(snap, "table-4"),
+        filters={'sku': sku, 'bodega': bodega},
+        page=page,
+        page_size=page_size,
+        disable_pagination=disable_pagination,
+        sort_by=sort_by,
+        descending=order == "desc",
+        cursor=cursor,
+    )
 
 
 @app.get("/api/table-5")
@@ -452,75 +462,76 @@ def get_table_5(
     disable_pagination: bool = Query(False),  # Option to disable pagination
     sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
     bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
+    sort_by: Optional[str] = Query(None),  # Column to sort by
+    order: str = Query("asc", pattern="^(asc|desc)$"),  # Sort direction
+    cursor: Optional[str] = Query(None),  # Keyset pagination cursor (empty for the first page)
 ):
-    filtered_df = df_solicitar.reset_index()
-    filtered_df = filtered_df.fillna(0)
-
-    # Filter by sku if specified (allow multiple selections)
-    if sku:
-        filtered_df = filtered_df[filtered_df['sku'].isin(sku)]
-    # Filter by bodega if specified (allow multiple selections)
-    if bodega:
-        filtered_df = filtered_df[filtered_df['bodega'].isin(bodega)]
-
-    # Total number of records
-    total_records = len(filtered_df)
-
-    # List of columns to round
-    columns_to_round = [
-        'mean', 'lead_time', 'SS', 'inventario', 'OCs', 'consumo_ult_sem',
-        'Consumo_ult_mes', 'inventario_total', 'solicitar', 'demanda_diaria_promedio',
-        'cobertura_dias', 'cobertura_meses'
-    ]
-
-    # Apply rounding to the specified columns
-    for column in columns_to_round:
-        filtered_df[column] = filtered_df[column].round(2)
-
-    # Convert the dataframe to a list of dictionaries
-    filtered_df = filtered_df.to_dict(orient='records')
-
-    # If pagination is disabled, return all data
-    if disable_pagination:
-        return {
-            "data": filtered_df
-        }
-
-    # Calculate pagination
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
-
-    # Slice the data for the current page
-    paginated_data = filtered_df[start_index:end_index]
-
-    # Calculate total pages
-    total_pages = (total_records + page_size - 1) // page_size
-
-    return {
-        "data": paginated_data,
-        "total": total_records,
-        "page": page,
-        "total_pages": total_pages
-    }
-
+    snap = get_snapshot(TABLES["table-5"]["stage"])
+    # Filter, sort and slice on the columns; only the rows of the page are converted to records
+    return query_table(
+        **table_source(snap, "table-5"),
+        filters={'sku': sku, 'bodega': bodega},
+        page=page,
+        page_size=page_size,
+        disable_pagination=disable_pagination,
+        sort_by=sort_by,
+        descending=order == "desc",
+        cursor=cursor,
+    )
+
+
+@app.get("/api/export/{table}")
+def export_table_data(
+    table: str,
+    format: str = Query("csv", pattern="^(csv|ndjson|arrow)$"),  # Output format
+    sku: Optional[List[str]] = Query(None),  # Filter by sku (allow multiselect)
+    bodega: Optional[List[str]] = Query(None),  # Filter by bodega (default includes both)
+    clase_abc: Optional[List[str]] = Query(None),  # Filter by clase_abc (table-1 only)
+    sort_by: Optional[str] = Query(None),  # Column to sort by
+    order: str = Query("asc", pattern="^(asc|desc)$"),  # Sort direction
+):
+    if table not in TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table '{table}'")
+    snap = get_snapshot(TABLES[table]["stage"])
+    requested = {'sku': sku, 'bodega': bodega, 'clase_abc': clase_abc}
+    filters = {column: requested[column] for column in TABLES[table]["filters"]}
+    # The body is written chunk by chunk while the client reads it
+    chunks = export_table(
+        **table_source(snap, table),
+        format=format,
+        filters=filters,
+        sort_by=sort_by,
+        descending=order == "desc",
+        chunk_rows=EXPORT_CHUNK_ROWS,
+    )
+    extension = "arrows" if format == "arrow" else format
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{extension}"'},
+    )
 
 @app.get("/api/available-skus")
 def get_available_skus(bodega: Optional[str] = Query(None)):
+    snap = get_snapshot("aggregates")
+    index = snap.indexes['df_mensual']
     # If bodega filter is provided, filter by bodega
     if bodega:
-        skus = df_mensual[df_mensual['bodega'] == bodega]['sku'].unique().tolist()
+        skus = index.values('sku', index.positions('bodega', [bodega]))
     else:
         # If no bodega filter is provided, return all SKUs
-        skus = df_mensual['sku'].unique().tolist()
+        skus = index.values('sku')
     
     return {"data": skus}
 
 @app.get("/api/available-years")
 def get_available_years():
-    years = df_mensual['mes_año'].dt.year.unique().astype(str).tolist()  # Convert years to strings
+    snap = get_snapshot("aggregates")
+    years = [str(year) for year in snap.indexes['df_mensual'].values('year')]  # Convert years to strings
     return {"data": years}
 
 @app.get("/api/available-bodegas")
 def get_available_bodegas():
-    bodegas = df_mensual['bodega'].unique().tolist()
+    snap = get_snapshot("aggregates")
+    bodegas = snap.indexes['df_mensual'].values('bodega')
     return {"data": bodegas}
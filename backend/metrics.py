@@ -0,0 +1,165 @@
+import bisect
+import math
+import threading
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+FIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class Metric:
+    """
+    A metric family in the Prometheus text format: one sample (or one set of buckets for
+    histograms) per combination of label values.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, tuple(zip(self.labels, key)), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            samples = list(self._samples())
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in samples]
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        for key, (counts, total) in self._values.items():
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", (*labels, ("le", _format_value(bound))), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+class Registry:
+    """
+    Metrics of this process. Metrics created with `counter`, `gauge` and `histogram` keep their
+    values between scrapes; collectors are called on every scrape and return metrics built
+    from the current state (for instance the data snapshot being served).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        metrics = list(self._metrics)
+        for collector in self._collectors:
+            metrics.extend(collector())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+def snapshot_metrics(snapshot):
+    """
+    Metrics of a data snapshot: stage and task times of its build, rows per frame and the
+    forecast fits (time per SKU, time and result per model).
+    """
+    version = Gauge("mochasa_snapshot_version", "Version of the data snapshot being served.")
+    stage_ready = Gauge("mochasa_snapshot_stage_ready_seconds", "Seconds from the start of the build until each stage was ready.", ("stage",))
+    task_seconds = Gauge("mochasa_pipeline_task_seconds", "Wall time of each pipeline task in the last build.", ("task",))
+    critical = Gauge("mochasa_pipeline_critical_path_seconds", "Wall time of the chain of tasks that decided the build time.")
+    rows = Gauge("mochasa_frame_rows", "Rows of each served frame.", ("frame",))
+    sku_seconds = Gauge("mochasa_forecast_sku_fit_seconds", "Time spent fitting the forecast models of each SKU in the last build.", ("sku",))
+    fit_seconds = Histogram("mochasa_forecast_model_fit_seconds", "Time of each forecast model fit in the last build.", ("model",), FIT_BUCKETS)
+    fits = Gauge("mochasa_forecast_model_fits", "Forecast model fits in the last build by result (ok, timeout or error).", ("model", "result"))
+    if snapshot is None:
+        return [version, stage_ready, task_seconds, critical, rows, sku_seconds, fit_seconds, fits]
+
+    version.set(snapshot.version)
+    for stage, seconds in snapshot.timings.items():
+        stage_ready.set(seconds, stage=stage)
+    for task, timing in snapshot.tasks.items():
+        task_seconds.set(timing["seconds"], task=task)
+    if snapshot.critical_path:
+        critical.set(round(sum(snapshot.tasks[task]["seconds"] for task in snapshot.critical_path), 3))
+    for name, df in snapshot.frames().items():
+        if df is not None:
+            rows.set(len(df), frame=name)
+    per_sku, per_model = {}, {}
+    for sku, model, seconds, result in snapshot.forecast_fits:
+        per_sku[sku] = per_sku.get(sku, 0) + seconds
+        fit_seconds.observe(seconds, model=model)
+        per_model[(model, result)] = per_model.get((model, result), 0) + 1
+    for sku, seconds in per_sku.items():
+        sku_seconds.set(round(seconds, 4), sku=sku)
+    for (model, result), count in per_model.items():
+        fits.set(count, model=model, result=result)
+    return [version, stage_ready, task_seconds, critical, rows, sku_seconds, fit_seconds, fits]
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+def normalize_query(query_params):
+    # Same key for any order of the parameters and of the values of multi-valued filters (sku, bodega, anio)
+    grouped = {}
+    for key, value in query_params.multi_items():
+        grouped.setdefault(key, []).append(value)
+    return tuple((key, tuple(sorted(values))) for key, values in sorted(grouped.items()))
+
+def make_etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+class ResponseCache:
+    """
+    In-process LRU cache of serialized responses, bounded by the total size of the bodies.
+    Entries belong to one snapshot version: when the version changes the cache is emptied,
+    so a stale response is never served after a reload.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _reset(self, version):
+        self._entries.clear()
+        self.size = 0
+        self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self.version:
+                self._reset(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, version, key, body, media_type):
+        # Returns the entry (body, media_type, etag) even if it is too large to be kept
+        entry = (body, media_type, make_etag(body))
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            if version != self.version:
+                self._reset(version)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (old_body, _, _) = self._entries.popitem(last=False)
+                self.size -= len(old_body)
+        return entry
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
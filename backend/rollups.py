@@ -0,0 +1,69 @@
+from indexes import FrameIndex
+
+# Aggregation levels of the cube and the keys kept at each one (besides the period)
+LEVELS = {
+    "sku": ("sku", "bodega"),
+    "bodega": ("bodega",),
+    "total": (),
+}
+
+class RollupCube:
+    """
+    Consumption totals pre-aggregated at load time for every level in LEVELS.
+
+    `period` is the time grain of the cube (mes_año or semana). When the period does not
+    carry the year (semana), `year_column` names the year and the cube keeps each level
+    both per year and summed over all years, as the weekly chart does without a year filter.
+    Every aggregate is sorted like a groupby over its keys, so a query is an index lookup.
+    """
+
+    def __init__(self, df, period, measure="consumo_tm", year_column=None):
+        self.period = period
+        self.measure = measure
+        self.year_column = year_column
+        self._cubes = {}
+        for level, keys in LEVELS.items():
+            self._add(df, level, [period, *keys], by_year=False)
+            if year_column is not None:
+                self._add(df, level, [year_column, period, *keys], by_year=True)
+
+    def _sum(self, df, keys):
+        # Summed in float64: the compacted frames may keep the measure as float32, exact per row but not in totals
+        measure = df[self.measure].astype("float64")
+        return measure.groupby([df[key] for key in keys], observed=True).sum().reset_index()
+
+    def _add(self, df, level, keys, by_year):
+        frame = self._sum(df, keys)
+        spec = {key: key for key in LEVELS[level]}
+        if by_year:
+            spec["year"] = self.year_column
+        elif self.year_column is None:
+            spec["year"] = lambda frame: frame[self.period].dt.year
+        self._cubes[(level, by_year)] = (frame, FrameIndex.from_frame(frame, spec))
+
+    def _aggregate(self, rows, level):
+        return self._sum(rows, [self.period, *LEVELS[level]])
+
+    def query(self, level="sku", year=None, sku=None, bodega=None):
+        """
+        Totals of `level` per period for the rows that match the filters.
+        """
+        if sku and level != "sku":
+            # SKU filters are only kept at the SKU level; the selection is summed from there
+            return self._aggregate(self.query("sku", year, sku, bodega), level)
+        if bodega and level == "total":
+            # Likewise bodega filters are summed from the bodega level
+            return self._aggregate(self.query("bodega", year, sku, bodega), level)
+        filters = {"sku": sku, "bodega": bodega} if level == "sku" else {"bodega": bodega} if level == "bodega" else {}
+
+        if self.year_column is None or not year:
+            frame, index = self._cubes[(level, False)]
+            if self.year_column is None:
+                filters["year"] = year
+            return index.filter(frame, **filters)
+
+        frame, index = self._cubes[(level, True)]
+        rows = index.filter(frame, year=year, **filters)
+        if len(set(year)) == 1:
+            return rows.drop(columns=self.year_column)
+        return self._aggregate(rows, level)
@@ -0,0 +1,113 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable
+
+@dataclass(frozen=True)
+class Task:
+    """
+    One step of a pipeline: `run` is called with the values named in `inputs` (positionally)
+    and returns the values named in `outputs` (a tuple in that order, or the value itself
+    when there is a single output).
+    """
+    name: str
+    inputs: tuple
+    outputs: tuple
+    run: Callable
+
+def check_graph(tasks, provided=()):
+    """
+    Raise ValueError if a value is produced twice, an input is never produced or the
+    tasks depend on each other in a cycle.
+    """
+    producers = {}
+    for task in tasks:
+        for name in task.outputs:
+            if name in producers or name in provided:
+                raise ValueError(f"Value '{name}' is produced more than once")
+            producers[name] = task.name
+    available = set(provided)
+    pending = list(tasks)
+    while pending:
+        ready = [task for task in pending if all(name in available for name in task.inputs)]
+        if not ready:
+            missing = sorted({name for task in pending for name in task.inputs if name not in producers and name not in provided})
+            if missing:
+                raise ValueError(f"Inputs never produced: {', '.join(missing)}")
+            raise ValueError(f"Cycle between tasks: {', '.join(task.name for task in pending)}")
+        for task in ready:
+            pending.remove(task)
+            available.update(task.outputs)
+
+def _timed(task, arguments):
+    started = time.perf_counter()
+    result = task.run(*arguments)
+    finished = time.perf_counter()
+    outputs = {task.outputs[0]: result} if len(task.outputs) == 1 else dict(zip(task.outputs, result, strict=True))
+    return outputs, started, finished
+
+def run_tasks(tasks, workers=None, values=None, on_done=None):
+    """
+    Run each task as soon as all its inputs exist, up to `workers` tasks at a time (every
+    ready task by default), and return (values, timings).
+
+    `timings[name]` holds the start offset and the wall time in seconds of each task, relative
+    to the start of the run. After each task `on_done(task, values, timings, running)` is
+    called from the calling thread with the values produced so far and the names of the
+    tasks still running. If a task fails no new task is started; the running ones are
+    awaited and the error is raised.
+    """
+    check_graph(tasks, tuple(values or ()))
+    values = dict(values or {})
+    timings = {}
+    pending = list(tasks)
+    running = {}
+    origin = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=workers or max(len(tasks), 1), thread_name_prefix="pipeline")
+
+    def submit_ready():
+        for task in [task for task in pending if all(name in values for name in task.inputs)]:
+            if workers and len(running) >= workers:
+                break
+            pending.remove(task)
+            running[executor.submit(_timed, task, [values[name] for name in task.inputs])] = task
+
+    try:
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            finished_tasks = []
+            for future in done:
+                task = running.pop(future)
+                outputs, started, finished = future.result()
+                values.update(outputs)
+                timings[task.name] = {"start": round(started - origin, 3), "seconds": round(finished - started, 3)}
+                finished_tasks.append(task)
+            # Start the tasks that became ready before running the callbacks
+            submit_ready()
+            if on_done is not None:
+                for task in finished_tasks:
+                    on_done(task, values, timings, [other.name for other in running.values()])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return values, timings
+
+def critical_path(tasks, timings):
+    """
+    Names of the chain of tasks that decided the total time: from the task that finished last,
+    follow back the input whose producer finished last.
+    """
+    producers = {name: task for task in tasks for name in task.outputs}
+    end = {name: timing["start"] + timing["seconds"] for name, timing in timings.items()}
+    finished = [task for task in tasks if task.name in end]
+    if not finished:
+        return []
+    task = max(finished, key=lambda task: end[task.name])
+    path = [task.name]
+    while True:
+        previous = [producers[name] for name in task.inputs if name in producers and producers[name].name in end]
+        if not previous:
+            break
+        task = max(previous, key=lambda task: end[task.name])
+        path.append(task.name)
+    return path[::-1]
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+class AlmacenSeries:
+    """
+    Series mensuales de todos los SKUs en arreglos contiguos, ordenadas por SKU y mes.
+
+    Se construye una sola vez a partir del agregado mensual. Cada SKU ocupa un tramo
+    [offset, offset + largo) de los arreglos `ordinales` y `valores`, y `indice` permite
+    obtener ese tramo y la bodega del SKU en O(1), sin filtrar ni ordenar el DataFrame.
+    """
+
+    def __init__(self, df, sku_column='sku', consumo_column='consumo_tm', periodo_column='mes_año', bodega_column='bodega'):
+        codigos, skus = pd.factorize(df[sku_column], sort=True)
+        periodos = df[periodo_column]
+        ordinales = periodos.array.asi8 if hasattr(periodos.array, 'asi8') else periodos.rank(method='dense').to_numpy()
+
+        # Orden estable por SKU y mes (las filas sin SKU quedan fuera)
+        orden = np.lexsort((ordinales, codigos))
+        orden = orden[codigos[orden] >= 0]
+
+        # Posiciones de las filas de `df` en el orden del almacén
+        self.consumo_column = consumo_column
+        self.orden = orden
+        self.codigos = codigos[orden]
+        self.ordinales = ordinales[orden]
+        self.valores = df[consumo_column].to_numpy(dtype=float)[orden]
+        self.skus = np.asarray(skus, dtype=object)
+        self.largos = np.bincount(self.codigos, minlength=len(self.skus))
+        self.offsets = np.concatenate(([0], np.cumsum(self.largos)[:-1])).astype(np.int64)
+        if bodega_column in df.columns:
+            # Bodega de la primera fila (mes más antiguo) de cada SKU
+            self.bodegas = df[bodega_column].to_numpy()[orden][self.offsets]
+        else:
+            self.bodegas = np.full(len(self.skus), None, dtype=object)
+
+        self.indice = {
+            sku: (int(offset), int(largo), bodega)
+            for sku, offset, largo, bodega in zip(self.skus, self.offsets, self.largos, self.bodegas)
+        }
+
+    def __len__(self):
+        return len(self.skus)
+
+    def __contains__(self, sku):
+        return sku in self.indice
+
+    def serie(self, sku):
+        """
+        Devuelve (ordinales, valores, bodega) del SKU; los arreglos son vistas, no copias.
+        """
+        offset, largo, bodega = self.indice[sku]
+        return self.ordinales[offset:offset + largo], self.valores[offset:offset + largo], bodega
+
+    def posiciones(self):
+        """
+        Posición de cada elemento dentro de la serie de su SKU.
+        """
+        return np.arange(len(self.codigos)) - self.offsets[self.codigos]
+
+    def matriz(self, ancho_minimo=0):
+        """
+        Matriz SKU×mes con las series alineadas a la izquierda y rellenada con NaN.
+        """
+        columnas = max(int(self.largos.max(initial=0)), ancho_minimo)
+        matriz = np.full((len(self.skus), columnas), np.nan)
+        matriz[self.codigos, self.posiciones()] = self.valores
+        return matriz
@@ -0,0 +1,360 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from functools import partial
+import pandas as pd
+from compact import FrameCompactor, frame_memory
+from indexes import FrameIndex
+from rollups import RollupCube
+from scheduler import Task, critical_path, run_tasks
+from constants import EXCEL_FILE_CONSUMPTIONS, EXCEL_FILE_COSTS, COMPACT_FRAMES, PIPELINE_WORKERS
+
+# Create a logger object
+logger = logging.getLogger('uvicorn.error')
+
+SOURCE_FILES = (EXCEL_FILE_CONSUMPTIONS, EXCEL_FILE_COSTS)
+
+def source_signature():
+    # (size, mtime) of each source workbook; None when the file is missing
+    signature = {}
+    for path in SOURCE_FILES:
+        try:
+            stat = os.stat(path)
+            signature[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            signature[path] = None
+    return signature
+
+# Load stages in build order and the frames each one publishes
+STAGES = {
+    "aggregates": ("df_mensual", "df_semanal"),
+    "abc": ("df_analizado", "summary", "df_abc", "df_conteos"),
+    "forecasts": ("df_ultimos_6", "conteo_modelo_bodega"),
+    "policies": ("df_unido", "df_periodico", "df_EOQ", "df_solicitar", "conteo_politica_bodega"),
+}
+
+def _year(column):
+    return lambda df: df[column].dt.year
+
+# Filter indexes built for each served frame: index name -> column or function of the frame
+INDEXES = {
+    "df_mensual": {"sku": "sku", "bodega": "bodega", "year": _year("mes_año")},
+    "df_semanal": {"sku": "sku", "bodega": "bodega", "year": "anio"},
+    "df_ultimos_6": {"sku": "sku", "bodega": "bodega", "year": _year("mes_año")},
+    "df_abc": {"bodega": "bodega", "clase_abc": "clase_abc"},
+    "df_unido": {"sku": "sku", "bodega": "bodega"},
+    "df_periodico": {"sku": "sku", "bodega": "bodega"},
+    "df_EOQ": {"sku": "sku", "bodega": "bodega"},
+    "df_solicitar": {"sku": "sku", "bodega": "bodega"},
+}
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Every frame derived from one version of the source workbooks.
+    Requests read all their data from a single snapshot, so they never see half-updated state.
+    During the first load the snapshot is published stage by stage: frames of stages
+    that have not finished yet are None and their stage is missing from `timings`.
+    """
+    version: int
+    created_at: float
+    sources: dict
+    # Seconds from the start of the build until each stage was ready
+    timings: dict = field(default_factory=dict)
+    # Start offset and wall time of each pipeline task, and the chain of tasks that decided the total
+    tasks: dict = field(default_factory=dict)
+    critical_path: tuple = ()
+    # (sku, model, seconds, result) of each forecast model fitted in the build
+    forecast_fits: tuple = ()
+    # FrameIndex of each frame in INDEXES, by frame name
+    indexes: dict = field(default_factory=dict)
+    # RollupCube of the monthly and weekly consumption, by grain
+    rollups: dict = field(default_factory=dict)
+    # Size in bytes of each frame before it was compacted
+    bytes_before: dict = field(default_factory=dict)
+    df_mensual: pd.DataFrame = None
+    df_semanal: pd.DataFrame = None
+    df_analizado: pd.DataFrame = None
+    df_ultimos_6: pd.DataFrame = None
+    summary: pd.DataFrame = None
+    conteo_modelo_bodega: pd.DataFrame = None
+    df_abc: pd.DataFrame = None
+    df_conteos: pd.DataFrame = None
+    df_unido: pd.DataFrame = None
+    df_periodico: pd.DataFrame = None
+    df_EOQ: pd.DataFrame = None
+    df_solicitar: pd.DataFrame = None
+    conteo_politica_bodega: pd.DataFrame = None
+
+    def frames(self):
+        return {name: getattr(self, name) for names in STAGES.values() for name in names}
+
+    def has_stage(self, stage):
+        return stage in self.timings
+
+    @property
+    def complete(self):
+        return all(stage in self.timings for stage in STAGES)
+
+def build_indexes(frames):
+    return {name: FrameIndex.from_frame(df, INDEXES[name]) for name, df in frames.items() if name in INDEXES and df is not None}
+
+def build_rollups(frames):
+    if frames.get("df_mensual") is None:
+        return {}
+    return {
+        "monthly": RollupCube(frames["df_mensual"], "mes_año"),
+        "weekly": RollupCube(frames["df_semanal"], "semana", year_column="anio"),
+    }
+
+def snapshot_metadata(snapshot):
+    # Everything but the frames and the structures derived from them, as JSON
+    return {
+        "created_at": snapshot.created_at,
+        "sources": {path: list(signature) if signature else None for path, signature in snapshot.sources.items()},
+        "timings": snapshot.timings,
+        "tasks": snapshot.tasks,
+        "critical_path": list(snapshot.critical_path),
+        "forecast_fits": [list(fit) for fit in snapshot.forecast_fits],
+        "bytes_before": snapshot.bytes_before,
+    }
+
+def snapshot_from_store(version, metadata, frames):
+    # Rebuild a snapshot around the frames mapped from a SnapshotStore
+    return Snapshot(
+        version=version,
+        created_at=metadata["created_at"],
+        sources={path: tuple(signature) if signature else None for path, signature in metadata["sources"].items()},
+        timings=metadata["timings"],
+        tasks=metadata.get("tasks", {}),
+        critical_path=tuple(metadata.get("critical_path", ())),
+        forecast_fits=tuple(tuple(fit) for fit in metadata.get("forecast_fits", ())),
+        indexes=build_indexes(frames),
+        rollups=build_rollups(frames),
+        bytes_before=metadata["bytes_before"],
+        **frames,
+    )
+
+def pipeline_tasks():
+    """
+    Tasks of the load pipeline with the values each one reads and produces. Tasks that do not
+    depend on each other (the two workbooks, the weekly aggregate, the ABC classes and the
+    forecasts) run concurrently.
+    """
+    # The pipeline is only imported by the process that builds snapshots; serving a
+    # shared snapshot or a bundle never loads it
+    from utils import cargar_consumos, agregar_consumos, cargar_hojas_costos, cargar_analisis, cargar_pronosticos, cargar_datos_4, cargar_datos_5, cargar_datos_6
+
+    return [
+        Task("consumption", (), ("consumos",), cargar_consumos),
+        Task("costs", (), ("hojas_costos",), cargar_hojas_costos),
+        Task("monthly", ("consumos",), ("df_mensual",), agregar_consumos),
+        Task("weekly", ("consumos",), ("df_semanal",), partial(agregar_consumos, field="week")),
+        Task("analysis", ("df_mensual",), ("df_analizado", "summary", "almacen"), cargar_analisis),
+        Task("abc_classes", ("df_analizado",), ("df_abc", "df_conteos"), cargar_datos_4),
+        Task("forecasts", ("df_mensual", "summary", "almacen"), ("df_ultimos_6", "conteo_modelo_bodega", "df_modelos"), cargar_pronosticos),
+        Task("merge", ("df_ultimos_6", "df_abc", "summary"), ("df_unido",), cargar_datos_5),
+        Task("policies", ("df_unido", "hojas_costos"), ("df_periodico", "df_EOQ", "df_solicitar", "conteo_politica_bodega"), cargar_datos_6),
+    ]
+
+def build_snapshot(version, on_stage=None, on_task=None):
+    """
+    Run the pipeline tasks as their inputs become available (see `pipeline_tasks`).
+    When every frame of a stage exists, `on_stage(snapshot, stage)` receives a new immutable
+    snapshot that contains the frames built so far; `on_task(timings, running)` is called
+    after each task with the task timings so far and the tasks still running.
+    """
+    # Take the signature first so a change made during the build triggers another reload
+    snapshot = Snapshot(version=version, created_at=time.time(), sources=source_signature())
+    tasks = pipeline_tasks()
+    compactor = FrameCompactor()
+    started = time.perf_counter()
+
+    def publish_ready(task, values, timings, running):
+        # Tasks read the frames as built (`values`); requests read the compacted copies
+        nonlocal snapshot
+        for stage, names in STAGES.items():
+            if snapshot.has_stage(stage) or not all(name in values for name in names):
+                continue
+            frames = {name: values[name] for name in names}
+            bytes_before = {**snapshot.bytes_before, **{name: frame_memory(df) for name, df in frames.items()}}
+            if COMPACT_FRAMES:
+                frames = {name: compactor.compact(df) for name, df in frames.items()}
+            indexes = {**snapshot.indexes, **build_indexes(frames)}
+            rollups = build_rollups(frames) if stage == "aggregates" else snapshot.rollups
+            # Seconds from the start of the build until the stage was ready
+            stage_timings = {**snapshot.timings, stage: round(time.perf_counter() - started, 3)}
+            snapshot = replace(snapshot, timings=stage_timings, indexes=indexes, rollups=rollups, bytes_before=bytes_before, **frames)
+            logger.info(f"Snapshot v{version}: stage '{stage}' ready after {stage_timings[stage]:.1f}s.")
+            if on_stage is not None:
+                on_stage(snapshot, stage)
+        if on_task is not None:
+            on_task(dict(timings), running)
+
+    values, timings = run_tasks(tasks, workers=PIPELINE_WORKERS or None, on_done=publish_ready)
+    path = critical_path(tasks, timings)
+    logger.info(
+        f"Snapshot v{version}: pipeline took {time.perf_counter() - started:.1f}s for "
+        f"{sum(timing['seconds'] for timing in timings.values()):.1f}s of tasks; critical path {' -> '.join(path)}."
+    )
+    df_modelos = values["df_modelos"]
+    forecast_fits = tuple(
+        (str(sku), model, seconds, result)
+        for sku, fits in zip(df_modelos.get("sku", []), df_modelos.get("ajustes", []))
+        for model, seconds, result in fits
+    )
+    return replace(snapshot, tasks=timings, critical_path=tuple(path), forecast_fits=forecast_fits)
+
+class SnapshotManager:
+    """
+    Holds the current snapshot and builds the next one in the background.
+    The new snapshot is published with a single reference assignment, so readers
+    always get either the old or the new version, never a mix.
+
+    With a SnapshotStore, only the worker process that holds the store's leader lock builds
+    snapshots; every worker (the leader included) serves the frames mapped from the store.
+    In read-only mode nothing is built: the manager serves the bundle written to the store
+    by `build.py` and follows the new versions written there.
+    """
+
+    def __init__(self, store=None, read_only=False):
+        self.current = None
+        self.read_only = read_only
+        self.reloading = False
+        self.last_error = None
+        # Stage timings of the snapshot being built, None when idle
+        self.building = None
+        self.store = store
+        self._marker = None
+        self._build_lock = threading.Lock()
+        self._watcher = None
+
+    def reload(self):
+        # Returns False if another reload is already running
+        if self.read_only:
+            self._follow()
+            return self.current is not None
+        if not self._build_lock.acquire(blocking=False):
+            return False
+        try:
+            self.reloading = True
+            version = (self.current.version + 1) if self.current else 1
+            logger.info(f"Building data snapshot v{version}.")
+            started = time.time()
+            self.building = {"version": version, "timings": {}, "tasks": {}, "running": []}
+            snapshot = build_snapshot(version, on_stage=self._on_stage, on_task=self._on_task)
+            # Atomic swap
+            self._publish(snapshot)
+            self.last_error = None
+            logger.info(f"Data snapshot v{version} ready in {time.time() - started:.1f}s.")
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            logger.exception("Failed to build data snapshot; keeping the previous one.")
+            return False
+        finally:
+            self.building = None
+            self.reloading = False
+            self._build_lock.release()
+
+    def _on_task(self, timings, running):
+        self.building = {**self.building, "tasks": timings, "running": running}
+
+    def _on_stage(self, snapshot, stage):
+        self.building = {**self.building, "timings": dict(snapshot.timings)}
+        # Partial snapshots are only published while nothing complete is being served;
+        # a reload keeps serving the previous version until the new one is finished
+        current = self.current
+        if current is None or (not current.complete and len(snapshot.timings) >= len(current.timings)):
+            self._publish(snapshot)
+
+    def _publish(self, snapshot):
+        if self.store is None:
+            self.current = snapshot
+            return
+        self.store.publish(snapshot.version, snapshot_metadata(snapshot), snapshot.frames())
+        # Serve the mapped copy like the other workers, so the built frames can be freed
+        self._follow()
+
+    def _follow(self):
+        # Map the version published in the store if it changed since the last check
+        marker = self.store.marker()
+        if marker is None or marker == self._marker:
+            return
+        loaded = self.store.load()
+        if loaded is not None:
+            self.current = snapshot_from_store(*loaded)
+            self._marker = marker
+
+    def reload_in_background(self):
+        if self.reloading or self.read_only:
+            return False
+        if self.store is not None and not self.store.try_lead():
+            # Only the leader builds; it picks the request up on its next poll
+            self.store.request_reload()
+            return True
+        threading.Thread(target=self.reload, daemon=True).start()
+        return True
+
+    def has_changed(self):
+        return self.current is None or source_signature() != self.current.sources
+
+    def watch(self, interval):
+        # Poll the source workbooks and rebuild when they change
+        def loop():
+            while True:
+                time.sleep(interval)
+                if self.has_changed() and not self.reloading:
+                    self.reload()
+        if self._watcher is None and interval > 0:
+            self._watcher = threading.Thread(target=loop, daemon=True)
+            self._watcher.start()
+
+    def start(self, interval, poll_interval=1.0):
+        """
+        Load the first snapshot in the background and keep it up to date: rebuild when the
+        workbooks change (checked every `interval` seconds, 0 disables it) or, with a store,
+        follow the versions published by the leader (checked every `poll_interval` seconds).
+        In read-only mode the bundle is mapped before returning.
+        """
+        if self.read_only:
+            try:
+                self._follow()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception(f"Failed to load the snapshot bundle in {self.store.root}.")
+            if self.current is None:
+                logger.error(f"No snapshot bundle in {self.store.root}; write one with `python build.py`.")
+        if self.store is None:
+            threading.Thread(target=self.reload, daemon=True).start()
+            self.watch(interval)
+            return
+        threading.Thread(target=self._run_shared, args=(interval, poll_interval), daemon=True).start()
+
+    def _run_shared(self, interval, poll_interval):
+        leading = False
+        last_check = time.time()
+        while True:
+            try:
+                if not leading and not self.read_only and self.store.try_lead():
+                    leading = True
+                    logger.info(f"Worker {os.getpid()} builds the shared data snapshot.")
+                    self._follow()
+                    # Reuse the version published by a previous leader when the workbooks did not change
+                    if self.current is None or not self.current.complete or self.has_changed():
+                        self.reload()
+                    last_check = time.time()
+                elif leading:
+                    requested = self.store.take_reload_request()
+                    if interval > 0 and time.time() - last_check >= interval:
+                        last_check = time.time()
+                        requested = requested or self.has_changed()
+                    if requested:
+                        self.reload()
+                else:
+                    self._follow()
+            except Exception:
+                logger.exception("Shared snapshot update failed.")
+            time.sleep(poll_interval)
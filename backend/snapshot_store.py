@@ -0,0 +1,182 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Create a logger object
+logger = logging.getLogger('uvicorn.error')
+
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+LOCK = "leader.lock"
+RELOAD_REQUEST = "reload.request"
+# Layout of the files; bundles written with another format are not loaded
+FORMAT = 1
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _write_column(directory, file_name, values):
+    # Writes one column (the .array of a Series or Index) and returns its spec for the manifest
+    path = os.path.join(directory, file_name)
+    if isinstance(values, pd.Categorical):
+        np.save(path, values.codes)
+        return {"kind": "category", "file": file_name + ".npy", "categories": values.categories.tolist()}
+    if isinstance(values, pd.arrays.PeriodArray):
+        np.save(path, values.asi8)
+        return {"kind": "period", "file": file_name + ".npy", "freq": values.freqstr}
+    data = np.asarray(values)
+    if data.dtype == object:
+        # Free-form values can not be mapped; they are copied into each process
+        np.save(path, data, allow_pickle=True)
+        return {"kind": "object", "file": file_name + ".npy"}
+    np.save(path, data)
+    return {"kind": "array", "file": file_name + ".npy"}
+
+class SnapshotStore:
+    """
+    Publishes the frames of a snapshot as NumPy files that every worker process maps read-only.
+
+    Each version lives in its own directory with a manifest (frames, column layout and snapshot
+    metadata); CURRENT names the directory being served. Numeric, categorical and period columns
+    are memory-mapped, so all workers share one copy of the data through the page cache.
+    Only the process that holds the leader lock builds snapshots; the others follow CURRENT.
+    The `keep` most recent versions are kept on disk.
+    """
+
+    def __init__(self, root, keep=1):
+        self.root = root
+        self.keep = keep
+        os.makedirs(root, exist_ok=True)
+        self._lock_file = None
+        self._written = {}
+        self._dtypes = {}
+
+    def try_lead(self):
+        if self._lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.root, LOCK), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # The lock is held for the life of the process and released by the OS if it dies
+        self._lock_file = lock_file
+        return True
+
+    def request_reload(self):
+        open(os.path.join(self.root, RELOAD_REQUEST), "w").close()
+
+    def take_reload_request(self):
+        try:
+            os.remove(os.path.join(self.root, RELOAD_REQUEST))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def marker(self):
+        # Changes whenever a new version or a new stage is published
+        try:
+            with open(os.path.join(self.root, CURRENT)) as f:
+                name = f.read().strip()
+            return name, os.stat(os.path.join(self.root, name, MANIFEST)).st_mtime_ns
+        except OSError:
+            return None
+
+    def current_version(self):
+        marker = self.marker()
+        return int(marker[0][1:]) if marker is not None else None
+
+    def publish(self, version, metadata, frames):
+        """
+        Write the frames not written yet for `version` and point CURRENT to it.
+        """
+        name = f"v{version}"
+        directory = os.path.join(self.root, name)
+        written = self._written.get(version)
+        if written is None:
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+            written = self._written[version] = {}
+
+        for frame_name, df in frames.items():
+            if df is None or frame_name in written:
+                continue
+            frame_dir = os.path.join(directory, frame_name)
+            os.makedirs(frame_dir, exist_ok=True)
+            columns = [[str(column), _write_column(frame_dir, f"c{i}", df[column].array)] for i, column in enumerate(df.columns)]
+            if isinstance(df.index, pd.RangeIndex):
+                index = {"kind": "range", "start": df.index.start, "stop": df.index.stop, "step": df.index.step}
+            else:
+                index = _write_column(frame_dir, "index", df.index.array)
+            written[frame_name] = {"columns": columns, "index": index}
+
+        _write_json(os.path.join(directory, MANIFEST), {"format": FORMAT, "version": version, "metadata": metadata, "frames": written})
+        self._set_current(name)
+        self._remove_old_versions(current=version)
+
+    def _set_current(self, name):
+        tmp = os.path.join(self.root, f"{CURRENT}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(self.root, CURRENT))
+
+    def _remove_old_versions(self, current):
+        # Workers that still map an older version keep their mappings after the files are removed
+        versions = sorted(
+            int(entry[1:]) for entry in os.listdir(self.root)
+            if entry.startswith("v") and entry[1:].isdigit() and os.path.isdir(os.path.join(self.root, entry))
+        )
+        kept = [version for version in versions if version <= current][-self.keep:]
+        for version in versions:
+            if version not in kept:
+                shutil.rmtree(os.path.join(self.root, f"v{version}"), ignore_errors=True)
+                self._written.pop(version, None)
+
+    def _read_column(self, directory, spec):
+        path = os.path.join(directory, spec["file"])
+        if spec["kind"] == "object":
+            return np.load(path, allow_pickle=True)
+        data = np.load(path, mmap_mode="r")
+        if spec["kind"] == "category":
+            # Frames that used one dictionary keep sharing one dtype
+            key = tuple(spec["categories"])
+            dtype = self._dtypes.setdefault(key, pd.CategoricalDtype(spec["categories"]))
+            return pd.Categorical.from_codes(data, dtype=dtype)
+        if spec["kind"] == "period":
+            return pd.arrays.PeriodArray(data, dtype=pd.PeriodDtype(spec["freq"]))
+        return data
+
+    def load(self):
+        """
+        Returns (version, metadata, frames) of the version named by CURRENT, or None.
+        """
+        marker = self.marker()
+        if marker is None:
+            return None
+        directory = os.path.join(self.root, marker[0])
+        self._dtypes = {}
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT:
+            raise ValueError(f"Unsupported snapshot format {manifest.get('format')} in {directory}")
+
+        frames = {}
+        for frame_name, spec in manifest["frames"].items():
+            frame_dir = os.path.join(directory, frame_name)
+            columns = {column: self._read_column(frame_dir, column_spec) for column, column_spec in spec["columns"]}
+            index = spec["index"]
+            if index["kind"] == "range":
+                index = pd.RangeIndex(index["start"], index["stop"], index["step"])
+            else:
+                index = pd.Index(self._read_column(frame_dir, index))
+            # copy=False keeps each column as a view of its mapped file
+            frames[frame_name] = pd.DataFrame(columns, index=index, copy=False)
+        return manifest["version"], manifest["metadata"], frames
@@ -0,0 +1,197 @@
+import base64
+import io
+import json
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi import HTTPException
+
+def encode_cursor(position, key=None):
+    payload = {"p": int(position)}
+    if key is not None:
+        payload["k"] = key.item() if isinstance(key, np.generic) else key
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(payload["p"]), payload.get("k")
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _after_cursor(keys, positions, position, key, descending):
+    # Rows strictly after (key, position) in the order used by the table; nulls go last
+    if keys is None:
+        return positions > position
+    nulls = pd.isna(keys)
+    if key is None:
+        return nulls & (positions > position)
+    after = nulls.copy()
+    valid = ~nulls
+    values = keys[valid]
+    beyond = values < key if descending else values > key
+    after[valid] = beyond | ((values == key) & (positions[valid] > position))
+    return after
+
+def select_rows(df, filters=None, index=None, sort_by=None, descending=False):
+    """
+    Positions of the rows that match every filter, in output order, and their sort keys.
+
+    `filters` maps a column to the accepted values (empty values are ignored); with a FrameIndex
+    in `index` they are resolved from its row positions instead of scanning the columns.
+    Only the key column is sorted; ties keep the original row order and nulls go last.
+    """
+    if index is not None:
+        positions = index.select(**(filters or {}))
+        if positions is None:
+            positions = np.arange(len(df))
+    else:
+        mask = np.ones(len(df), dtype=bool)
+        for column, values in (filters or {}).items():
+            if values:
+                mask &= df[column].isin(values).to_numpy()
+        positions = np.flatnonzero(mask)
+
+    keys = None
+    if sort_by is not None:
+        # "index" sorts by the row labels, sent as the index column of the tables that include it
+        column = df.index if sort_by == "index" and "index" not in df.columns else df[sort_by]
+        keys = column.to_numpy()[positions]
+        order = pd.Series(keys).sort_values(ascending=not descending, kind="stable", na_position="last").index.to_numpy()
+        positions, keys = positions[order], keys[order]
+    return positions, keys
+
+def materialize(df, positions, columns, round_columns=(), include_index=False, fill_nulls=True):
+    """
+    Output frame of the rows at `positions`: `columns` and `include_index` select the columns
+    like reset_index() on the whole frame did, nulls are sent as 0 and `round_columns` are
+    rounded to 2 decimals.
+    """
+    rows = df.iloc[positions][columns]
+    if include_index:
+        rows.insert(0, "index", df.index[positions])
+    # Categorical keys and downcast floats are sent as plain strings and float64 values
+    rows = rows.astype({
+        column: object if isinstance(dtype, pd.CategoricalDtype) else np.float64
+        for column, dtype in rows.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype) or dtype == np.float32
+    })
+    if fill_nulls:
+        rows = rows.fillna(0)
+    for column in round_columns:
+        rows[column] = rows[column].round(2)
+    return rows
+
+def _output_columns(df, columns, sort_by, include_index=False):
+    output_columns = list(columns) if columns is not None else list(df.columns)
+    sortable = ["index", *output_columns] if include_index else output_columns
+    if sort_by is not None and sort_by not in sortable:
+        raise HTTPException(status_code=400, detail=f"Unknown sort column '{sort_by}'")
+    return output_columns
+
+def query_table(
+    df,
+    filters=None,
+    index=None,
+    columns=None,
+    round_columns=(),
+    include_index=False,
+    page=1,
+    page_size=10,
+    disable_pagination=False,
+    sort_by=None,
+    descending=False,
+    cursor=None,
+):
+    """
+    Filter, sort and paginate a table on its columns and only build records for the rows returned
+    (see `select_rows` and `materialize`).
+    With `cursor` (empty string for the first page) the table is read in keyset mode: the
+    cursor stores the sort key and row of the last record, so deep pages do not depend on offsets.
+    """
+    output_columns = _output_columns(df, columns, sort_by, include_index)
+    positions, keys = select_rows(df, filters, index, sort_by, descending)
+    total_records = len(positions)
+
+    response = {}
+    if cursor is not None:
+        if cursor:
+            position, key = decode_cursor(cursor)
+            after = _after_cursor(keys, positions, position, key, descending)
+            positions = positions[after]
+            keys = keys[after] if keys is not None else None
+        has_more = len(positions) > page_size
+        positions = positions[:page_size]
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(positions[-1], None if keys is None or pd.isna(keys[page_size - 1]) else keys[page_size - 1])
+        response = {"total": total_records, "next_cursor": next_cursor}
+    elif not disable_pagination:
+        start_index = (page - 1) * page_size
+        positions = positions[start_index:start_index + page_size]
+        total_pages = (total_records + page_size - 1) // page_size
+        response = {"total": total_records, "page": page, "total_pages": total_pages}
+
+    # Materialize only the selected rows
+    rows = materialize(df, positions, output_columns, round_columns, include_index)
+    return {"data": rows.to_dict(orient="records"), **response}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+def export_table(
+    df,
+    format,
+    filters=None,
+    index=None,
+    columns=None,
+    round_columns=(),
+    include_index=False,
+    sort_by=None,
+    descending=False,
+    chunk_rows=5000,
+):
+    """
+    Returns a generator of the bytes of the whole table in CSV, NDJSON or Arrow IPC stream format.
+
+    Rows are materialized `chunk_rows` at a time, so memory stays bounded by the chunk and not
+    by the table. CSV and NDJSON carry the same values as the JSON tables; Arrow keeps nulls.
+    Columns and rows are checked and selected before the generator is returned, so a bad sort
+    column fails before the response starts and not in the middle of the stream.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{format}'")
+    output_columns = _output_columns(df, columns, sort_by, include_index)
+    positions, _ = select_rows(df, filters, index, sort_by, descending)
+    chunks = (
+        materialize(df, positions[start:start + chunk_rows], output_columns, round_columns, include_index, fill_nulls=format != "arrow")
+        for start in range(0, max(len(positions), 1), chunk_rows)
+    )
+    return _export_chunks(chunks, format)
+
+def _export_chunks(chunks, format):
+    if format == "csv":
+        for number, rows in enumerate(chunks):
+            yield rows.to_csv(index=False, header=number == 0).encode()
+    elif format == "ndjson":
+        for rows in chunks:
+            yield b"".join(orjson.dumps(record) + b"\n" for record in rows.to_dict(orient="records"))
+    elif format == "arrow":
+        import pyarrow as pa
+        sink = io.BytesIO()
+        schema = writer = None
+        for rows in chunks:
+            # Later chunks are cast to the schema of the first one
+            batch = pa.RecordBatch.from_pandas(rows, schema=schema, preserve_index=False)
+            if writer is None:
+                schema = batch.schema
+                writer = pa.ipc.new_stream(sink, schema)
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        writer.close()
+        yield sink.getvalue()
@@ -1,26 +1,47 @@
+import logging
+import multiprocessing
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import partial
 import pandas as pd
 import numpy as np 
-from statsmodels.tsa.seasonal import seasonal_decompose
-from scipy.stats import linregress
-from sklearn.metrics import mean_absolute_error
-from statsmodels.tsa.statespace.sarimax import SARIMAX
-from statsmodels.tsa.api import ExponentialSmoothing
-from sklearn.linear_model import LinearRegression
-from constants import EXCEL_FILE_CONSUMPTIONS,EXCEL_FILE_COSTS, MONTHS
-
-def cargar_datos_1(field=None):
-    
-    # Load the Excel file
-    data_0 = pd.read_excel(EXCEL_FILE_CONSUMPTIONS)    
-
+from constants import (
+    EXCEL_FILE_CONSUMPTIONS, EXCEL_FILE_COSTS, MONTHS, FORECAST_WORKERS, FORECAST_CACHE, FORECAST_SELECTION,
+    FORECAST_MIN_HISTORY, FORECAST_ESCALATION_THRESHOLD, FORECAST_MODEL_TIMEOUT, FORECAST_SKU_TIMEOUT, FORECAST_BUDGET,
+    INVENTORY_POLICY, ABC_LIMITS
+)
+from series import AlmacenSeries
+from cache import leer_excel_cache, leer_libro_cache, huella_serie, leer_cache_pronosticos, guardar_cache_pronosticos
+
+# Create a logger object
+logger = logging.getLogger('uvicorn.error')
+
+# Columnas usadas de cada hoja (solo estas se guardan en la caché)
+COLUMNAS_CONSUMOS = ['anio', 'mes', 'dia', 'semana', 'sku', 'bodega', 'consumo_tm']
+COLUMNAS_LT = ['sku', 'lead_time']
+COLUMNAS_INVENTARIO = ['sku', 'inventario', 'OCs', 'consumo_ult_sem', 'Consumo_ult_mes']
+COLUMNAS_COSTO_MP = ['sku', 'anio', 'mes', 'costo']
+
+# Las hojas en caché guardan el resultado: al cambiar esta función se incrementa CACHE_FORMAT (cache.py)
+def derivar_fechas(df):
     # Mapping the month names to their corresponding values
-    data_0['mes'] = data_0['mes'].map(MONTHS)
+    df['mes'] = df['mes'].map(MONTHS)
 
-    # Combining year, month, and day columns to create a 'fecha' column
-    data_0['fecha'] = pd.to_datetime(data_0['anio'].astype(str) + '-' + data_0['mes'].astype(str) + '-' + data_0['dia'].astype(str))
+    # Combining year, month, and day (if present) columns to create a 'fecha' column
+    fecha = df['anio'].astype(str) + '-' + df['mes'].astype(str)
+    if 'dia' in df.columns:
+        fecha = fecha + '-' + df['dia'].astype(str)
+    df['fecha'] = pd.to_datetime(fecha)
 
     # Create a 'mes_año' column by extracting the period from the 'date'
-    data_0['mes_año'] = data_0['fecha'].dt.to_period('M')
+    df['mes_año'] = df['fecha'].dt.to_period('M')
+    return df
+
+def cargar_consumos():
+    
+    # Load the Excel file (from the columnar cache when the workbook did not change)
+    data_0 = leer_excel_cache(EXCEL_FILE_CONSUMPTIONS, columnas=COLUMNAS_CONSUMOS, derivar=derivar_fechas)
 
     # Get the latest consumption date for each 'sku'
     ultima_fecha_consumo = data_0.groupby("sku")["fecha"].max().reset_index()
@@ -30,27 +51,39 @@ def cargar_datos_1(field=None):
     items_consumo_2024 = ultima_fecha_consumo[ultima_fecha_consumo["ultima_fecha"].dt.year == 2024]["sku"]
 
     # Filter the data to only include items with consumption in 2024
-    tabla_consumo_2024 = data_0[data_0["sku"].isin(items_consumo_2024)]
-
-    # Filter the data to only include rows with 'MACROS' or 'MICROS' in the 'bodega' column
-    df = tabla_consumo_2024[tabla_consumo_2024['bodega'].isin(['MACROS', 'MICROS'])].reset_index(drop=True)
+    # and rows with 'MACROS' or 'MICROS' in the 'bodega' column in a single mask
+    mask = data_0["sku"].isin(items_consumo_2024) & data_0['bodega'].isin(['MACROS', 'MICROS'])
+    return data_0[mask].reset_index(drop=True)
 
+def agregar_consumos(df, field=None):
     if field == 'week':
         return df.groupby(['anio', 'semana', 'sku', 'bodega'])['consumo_tm'].sum().reset_index()
         
     # Return the sum of 'consumo_tm' grouped by 'month_year', 'sku', and 'bodega'
     return df.groupby(['mes_año','sku', 'bodega'])['consumo_tm'].sum().reset_index()
 
-def cargar_datos_2(field=None):
-    return cargar_datos_1('week')
-
-def cargar_datos_3(df_mensual): 
+def cargar_hojas_costos():
+    """
+    Lee las hojas 'lt', 'inventario' y 'costo_mp' de BASE-3 abriendo el libro una sola vez.
+    """
+    return leer_libro_cache(EXCEL_FILE_COSTS, {
+        'lt': {'columnas': COLUMNAS_LT},
+        'inventario': {'columnas': COLUMNAS_INVENTARIO},
+        'costo_mp': {'columnas': COLUMNAS_COSTO_MP, 'derivar': derivar_fechas},
+    })
+
+def cargar_analisis(df_mensual):
+    # Construir una sola vez el almacén de series por SKU que comparten el análisis y los pronósticos
+    almacen = AlmacenSeries(df_mensual)
     # Obtener df analizado
-    df_analizado = analizar_outliers_y_ajustar(df_mensual, 'sku', 'consumo_tm').reset_index(drop=True)
-    # Obtener los resultados de tendencia estacionalidad
-    resultados_tendencia, summary = analizar_tendencia_estacionalidad(df_analizado, 'sku', 'consumo_tm', ventana=3)
+    df_analizado = analizar_outliers_y_ajustar(df_mensual, 'sku', 'consumo_tm', almacen=almacen).reset_index(drop=True)
+    # Obtener el resumen de tendencia estacionalidad
+    summary = analizar_tendencia_estacionalidad(df_analizado, 'sku', 'consumo_tm', ventana=3, almacen=almacen)
+    return df_analizado, summary, almacen
+
+def cargar_pronosticos(df_mensual, summary, almacen=None):
     # Generar los pronósticos basados en el resumen
-    df_pronosticos, df_modelos = generar_pronosticos(df_mensual, summary, pasos_pronostico=3)
+    df_pronosticos, df_modelos = generar_pronosticos(df_mensual, summary, pasos_pronostico=3, almacen=almacen)
     # Convertir la columna 'mes_año' a formato de periodo mensual
     df_pronosticos['mes_año'] = df_pronosticos['mes_año'].dt.to_period('M')
     # Combinar los pronósticos con los datos históricos
@@ -61,7 +94,8 @@ def cargar_datos_3(df_mensual):
     df_ultimos_6 = df_final.groupby('sku').tail(6)
     # Obtener los resultados de pronostico
     conteo_modelo_bodega = df_modelos.groupby(['mejor_modelo', 'bodega']).size().reset_index(name='conteo')
-    return df_analizado, df_ultimos_6, summary, conteo_modelo_bodega
+    # df_modelos se devuelve también por los tiempos de ajuste de cada SKU
+    return df_ultimos_6, conteo_modelo_bodega, df_modelos
 
 def cargar_datos_4(df_analizado):
     return clasificacion_abc_por_bodega(df=df_analizado,bodega_column='bodega', sku_column='sku',consumo_column='consumo_ajustado')
@@ -72,91 +106,26 @@ def cargar_datos_5(ultimos_6, df_abc, summary):
     df_unido = pd.merge(pd.merge(anl[['sku', 'mean', 'std']], df_abc[['sku', 'clase_abc', 'bodega']], on='sku'), summary[['sku', 'variabilidad']], on='sku')
     return df_unido
 
-def cargar_datos_6(df_unido):
+def cargar_datos_6(df_unido, hojas_costos=None, parametros=None):
     # Lee las hojas en un diccionario de DataFrames
-    lt = pd.read_excel(EXCEL_FILE_COSTS, sheet_name='lt')
-    inventario = pd.read_excel(EXCEL_FILE_COSTS, sheet_name='inventario')
+    if hojas_costos is None:
+        hojas_costos = cargar_hojas_costos()
+    lt = hojas_costos['lt']
+    inventario = hojas_costos['inventario']
     inventario =inventario.groupby('sku')[['inventario', 'OCs', 'consumo_ult_sem', 'Consumo_ult_mes']].sum().reset_index()
     # Dividir las columnas seleccionadas por 1000
     inventario[['inventario', 'OCs', 'consumo_ult_sem', 'Consumo_ult_mes']] /= 1000
 
-    # Carga el archivo Excel
-    costo_mp = pd.read_excel(EXCEL_FILE_COSTS, sheet_name='costo_mp')
-    costo_mp ['mes'] = costo_mp ['mes'].map(MONTHS)
-    costo_mp ['fecha'] = pd.to_datetime(costo_mp ['anio'].astype(str) + '-' + costo_mp ['mes'].astype(str) )
-    # Agrupar datos a nivel mensual por SKU, año y bodega
-    costo_mp ['mes_año'] = costo_mp ['fecha'].dt.to_period('M')
+    costo_mp = hojas_costos['costo_mp']
     costo_promedio = costo_mp.groupby('sku')['costo'].mean().reset_index()
 
+    # Unir costo promedio, lead time e inventario en una sola tabla
     df_completo = pd.merge(df_unido, costo_promedio[['sku', 'costo']], on='sku', how='left')
-    # Rellenar los valores faltantes de costo_promedio con 100
-    df_completo['costo'] = df_completo['costo'].fillna(100)
-    # Hacer el merge del resultado con lead_time
     df_completo = pd.merge(df_completo, lt[['sku', 'lead_time']], on='sku', how='left')
-    # Rellenar los valores faltantes de lead_time con 30
-    df_completo['lead_time'] = df_completo['lead_time'].fillna(30)
-
-    #Costos
-    costo_mantener = 1.84  # Costo de mantener (por TM)
-    costo_recibir = 0.36   # Costo de recibir (por TM)
-    costo_pedir = 7.50     # Costo fijo de pedir
-    nivel_servicio = {'A': 0.95, 'B': 0.75, 'C': 0.70}  # Niveles de servicio según clase ABC
-    z_values = {'A': 1.645, 'B': 0.675, 'C': 0.524}    # Z-scores estándar
-
-    # Calcular h (costo de almacenar)
-    df_completo['h'] = 0.12*(df_completo['costo'] + costo_mantener + costo_recibir)
-    # Calcular demanda anual (D)
-    df_completo['demanda_anual'] = df_completo['mean'] * 12
-    # Asignar nivel de servicio (α) y z
-    df_completo['alpha'] = df_completo['clase_abc'].map(nivel_servicio)
-    df_completo['z'] = df_completo['clase_abc'].map(z_values)
-    # Calcular EOQ (Q) para SKUs No Variables
-    df_completo['EOQ'] = np.where(
-        df_completo['variabilidad'] == 'No Variable',
-        np.sqrt((2 * df_completo['demanda_anual'] * costo_pedir) / df_completo['h']),
-        np.nan)  # EOQ no aplica para SKUs variables
-
-    df_completo['T'] = np.where(
-    df_completo['variabilidad'] == 'Variable',5,np.nan)
-
-    # Calcular stock de seguridad (SS) para todos los SKUs
-    df_completo['SS'] = df_completo['z'] * df_completo['std'] * np.sqrt(df_completo['lead_time']/30)
-
-    # Calcular nivel objetivo para Revisión Periódica
-    df_completo['SS'] = np.where( df_completo['variabilidad'] == 'Variable',
-        df_completo['z'] * df_completo['std'] * np.sqrt((df_completo['lead_time']+df_completo['T'])/30),
-        df_completo['z'] * df_completo['std'] * np.sqrt(df_completo['lead_time']/30) )  # Nivel objetivo no aplica para SKUs No Variables
-
-    # Calcular nivel objetivo para Revisión Periódica
-    df_completo['nivel_objetivo'] = np.where(
-        df_completo['variabilidad'] == 'Variable',
-        ((df_completo['mean'])/30 * (df_completo['T'] + df_completo['lead_time'] ) )+ df_completo['SS'],
-        np.nan)  # Nivel objetivo no aplica para SKUs No Variables
-
-    # Calcular punto de reorden (R) para EOQ
-    df_completo['R'] = np.where(
-        df_completo['variabilidad'] == 'No Variable',
-        ((df_completo['mean']/30) * df_completo['lead_time']) + df_completo['SS'],
-        np.nan)  # Punto de reorden no aplica para SKUs Variables
-
-    # Asignar política sugerida
-    df_completo['politica'] = np.where(
-        df_completo['variabilidad'] == 'Variable',
-        'Revisión Periódica',
-        'EOQ')
-    
-    # Aplicar la lógica para generar pedidos
-    # Se une la politica de inventario con la información del inventario.
     df_completo = pd.merge(df_completo, inventario[['inventario','OCs', 'consumo_ult_sem', 'Consumo_ult_mes','sku']], on='sku', how='left')
-    # Tabla completa lista para aplicar las politicas
-    df_completo[['inventario','OCs', 'consumo_ult_sem', 'Consumo_ult_mes'] ]= df_completo[['inventario','OCs', 'consumo_ult_sem', 'Consumo_ult_mes']].fillna(0)
-    df_completo['inventario_total'] = (df_completo['inventario'] + df_completo['OCs'])
-    df_completo['solicitar'] = df_completo.apply(generar_pedido, axis=1)
 
-    # Calcular cobertura en días
-    df_completo['demanda_diaria_promedio'] = df_completo['mean'] * 12 / 365
-    df_completo['cobertura_dias'] = round(df_completo['inventario_total'] / df_completo['demanda_diaria_promedio'],0)
-    df_completo['cobertura_meses'] = df_completo['cobertura_dias'] / 30
+    # Calcular la política de inventario y los pedidos en un solo paso vectorizado
+    df_completo = calcular_politicas(df_completo, parametros)
 
     df_periodico=df_completo[['sku', 'mean','clase_abc', 'bodega', 'variabilidad', 'costo',
         'lead_time', 'h', 'demanda_anual','T', 'SS',
@@ -175,78 +144,227 @@ def cargar_datos_6(df_unido):
 
     return df_periodico, df_EOQ, df_solicitar, conteo_politica_bodega
 
-def clasificacion_abc_por_bodega(df, bodega_column, sku_column, consumo_column):
-    resultados = []
-    conteos_abc = []
-
-    # Agrupar por bodega
-    for bodega, datos_bodega in df.groupby(bodega_column):
-        # Calcular el consumo total por SKU dentro de la bodega
-        consumo_por_sku = datos_bodega.groupby(sku_column)[consumo_column].sum().reset_index()
-        consumo_por_sku = consumo_por_sku.sort_values(by=consumo_column, ascending=False)
-
-        # Calcular el porcentaje acumulado
-        consumo_por_sku['porcentaje'] = 100 * consumo_por_sku[consumo_column] / consumo_por_sku[consumo_column].sum()
-        consumo_por_sku['porcentaje_acumulado'] = consumo_por_sku['porcentaje'].cumsum()
-
-        # Asignar la categoría ABC
-        def asignar_clase(pct_acum):
-            if pct_acum <= 80:
-                return 'A'
-            elif pct_acum <= 95:
-                return 'B'
-            else:
-                return 'C'
-
-        consumo_por_sku['clase_abc'] = consumo_por_sku['porcentaje_acumulado'].apply(asignar_clase)
+def calcular_politicas(df, parametros=None):
+    """
+    Calcula EOQ, SS, R, nivel objetivo, cantidad a solicitar y cobertura para todos los SKUs
+    en un solo paso sobre arreglos de NumPy. `df` debe traer mean, std, clase_abc,
+    variabilidad, costo, lead_time, inventario, OCs y los consumos recientes.
+    `parametros` sobreescribe los valores de INVENTORY_POLICY.
+    """
+    p = {**INVENTORY_POLICY, **(parametros or {})}
+
+    # Rellenar los valores faltantes de costo y lead_time con los valores por defecto
+    costo = df['costo'].fillna(p['costo_defecto']).to_numpy(dtype=float)
+    lead_time = df['lead_time'].fillna(p['lead_time_defecto']).to_numpy(dtype=float)
+    existencias = df[['inventario','OCs', 'consumo_ult_sem', 'Consumo_ult_mes']].fillna(0)
+    media = df['mean'].to_numpy(dtype=float)
+    std = df['std'].to_numpy(dtype=float)
+    variable = (df['variabilidad'] == 'Variable').to_numpy()
+    no_variable = (df['variabilidad'] == 'No Variable').to_numpy()
+    # Asignar nivel de servicio (α) y z según la clase ABC
+    alpha = df['clase_abc'].map(p['nivel_servicio']).to_numpy(dtype=float)
+    z = df['clase_abc'].map(p['z_values']).to_numpy(dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calcular h (costo de almacenar) y demanda anual (D)
+        h = p['tasa_almacenamiento'] * (costo + p['costo_mantener'] + p['costo_recibir'])
+        demanda_anual = media * 12
+        # EOQ (Q) solo para SKUs No Variables; periodo de revisión T solo para SKUs Variables
+        eoq = np.where(no_variable, np.sqrt((2 * demanda_anual * p['costo_pedir']) / h), np.nan)
+        periodo_revision = np.where(variable, p['periodo_revision'], np.nan)
+        # Stock de seguridad (SS): la revisión periódica cubre lead time + T
+        ss = np.where(variable,
+            z * std * np.sqrt((lead_time + periodo_revision) / 30),
+            z * std * np.sqrt(lead_time / 30))
+        # Nivel objetivo para Revisión Periódica y punto de reorden (R) para EOQ
+        nivel_objetivo = np.where(variable, (media / 30 * (periodo_revision + lead_time)) + ss, np.nan)
+        punto_reorden = np.where(no_variable, ((media / 30) * lead_time) + ss, np.nan)
+        politica = np.where(variable, 'Revisión Periódica', 'EOQ')
+
+        # Generar pedidos: EOQ si el inventario total está bajo R; en revisión periódica
+        # lo necesario para alcanzar el nivel objetivo
+        inventario_total = (existencias['inventario'] + existencias['OCs']).to_numpy(dtype=float)
+        solicitar = np.where(variable,
+            np.maximum(nivel_objetivo - inventario_total, 0),
+            np.where(inventario_total < punto_reorden, eoq, 0.0))
+
+        # Calcular cobertura en días
+        demanda_diaria_promedio = media * 12 / 365
+        cobertura_dias = np.round(inventario_total / demanda_diaria_promedio, 0)
+
+    return df.assign(
+        costo=costo, lead_time=lead_time,
+        h=h, demanda_anual=demanda_anual, alpha=alpha, z=z,
+        EOQ=eoq, T=periodo_revision, SS=ss, nivel_objetivo=nivel_objetivo, R=punto_reorden, politica=politica,
+        inventario=existencias['inventario'], OCs=existencias['OCs'],
+        consumo_ult_sem=existencias['consumo_ult_sem'], Consumo_ult_mes=existencias['Consumo_ult_mes'],
+        inventario_total=inventario_total, solicitar=solicitar,
+        demanda_diaria_promedio=demanda_diaria_promedio,
+        cobertura_dias=cobertura_dias, cobertura_meses=cobertura_dias / 30)
+
+def clasificacion_abc_por_bodega(df, bodega_column, sku_column, consumo_column, limites=None):
+    """
+    Clasifica los SKUs de todas las bodegas en A/B/C en un solo paso agrupado: consumo por
+    (bodega, SKU), orden descendente dentro de cada bodega y porcentaje acumulado.
+    `limites` son los porcentajes acumulados máximos de las clases A y B (ABC_LIMITS por defecto).
+    Devuelve la clasificación y el conteo de SKUs por clase y bodega.
+    """
+    limite_a, limite_b = ABC_LIMITS if limites is None else limites
 
-        # Agregar la columna de bodega para mantener el contexto
-        consumo_por_sku[bodega_column] = bodega
+    # Calcular el consumo total por SKU dentro de cada bodega, ordenado de mayor a menor
+    consumo_por_sku = df.groupby([bodega_column, sku_column])[consumo_column].sum().reset_index()
+    consumo_por_sku = consumo_por_sku.sort_values(
+        [bodega_column, consumo_column], ascending=[True, False], kind='stable').reset_index(drop=True)
 
-        # Agregar a los resultados
-        resultados.append(consumo_por_sku)
+    # Calcular el porcentaje acumulado por bodega
+    por_bodega = consumo_por_sku.groupby(bodega_column, sort=False)
+    consumo_por_sku['porcentaje'] = 100 * consumo_por_sku[consumo_column] / por_bodega[consumo_column].transform('sum')
+    consumo_por_sku['porcentaje_acumulado'] = consumo_por_sku.groupby(bodega_column, sort=False)['porcentaje'].cumsum()
 
-        # Calcular conteo de SKUs por clase ABC en esta bodega
-        conteo = consumo_por_sku['clase_abc'].value_counts().reset_index()
-        conteo.columns = ['clase_abc', 'conteo']
-        conteo[bodega_column] = bodega
-        conteos_abc.append(conteo)
+    # Asignar la categoría ABC
+    pct_acum = consumo_por_sku['porcentaje_acumulado'].to_numpy()
+    consumo_por_sku['clase_abc'] = np.select([pct_acum <= limite_a, pct_acum <= limite_b], ['A', 'B'], 'C')
 
-    # Combinar los resultados en un solo DataFrame
-    df_clasificacion_abc = pd.concat(resultados, ignore_index=True)
+    df_clasificacion_abc = consumo_por_sku[[sku_column, consumo_column, 'porcentaje', 'porcentaje_acumulado', 'clase_abc', bodega_column]]
 
-    # Combinar los conteos de SKUs por clase y bodega
-    df_conteos_abc = pd.concat(conteos_abc, ignore_index=True)
+    # Calcular conteo de SKUs por clase ABC en cada bodega (de mayor a menor conteo)
+    df_conteos_abc = df_clasificacion_abc.groupby([bodega_column, 'clase_abc']).size().reset_index(name='conteo')
+    df_conteos_abc = df_conteos_abc.sort_values(
+        [bodega_column, 'conteo', 'clase_abc'], ascending=[True, False, True], kind='stable')
+    df_conteos_abc = df_conteos_abc[['clase_abc', 'conteo', bodega_column]].reset_index(drop=True)
 
     return df_clasificacion_abc, df_conteos_abc
 
-def analizar_outliers_y_ajustar(data, grupo, columna):
-    result = []
-    for item, subset in data.groupby(grupo):
-        # Calcular límites usando IQR
-        Q1 = subset[columna].quantile(0.25)
-        Q3 = subset[columna].quantile(0.75)
-        IQR = Q3 - Q1
-        limite_inferior = Q1 - 1.5 * IQR
-        # limite_superior = Q3 + 1.5 * IQR
-
-        # Detectar outliers
-        #subset['es_outlier'] = (subset[columna] < limite_inferior) | (subset[columna] > limite_superior)
-        subset['es_outlier'] = subset[columna] < limite_inferior
-        # Reemplazar valores de consumo_tm para los outliers con el promedio de los datos no outliers
-        promedio_no_outliers = subset[~subset['es_outlier']][columna].mean()
-        subset['consumo_ajustado'] = subset.apply(
-            lambda row: promedio_no_outliers if row['es_outlier'] else row[columna], axis=1
-        )
-
-        result.append(subset)
-
-    # Combinar resultados
-    return pd.concat(result)
-
-def analizar_tendencia_estacionalidad(df, sku_column, consumo_column, ventana=3):
+def analizar_outliers_y_ajustar(data, grupo, columna, almacen=None):
+    """
+    Detecta outliers bajos por grupo con el criterio IQR y los reemplaza por el promedio
+    de los datos no outliers del grupo. Los cuantiles y promedios se calculan con
+    reducciones agrupadas sobre códigos enteros y se propagan a las filas, sin bucles por grupo.
+
+    Con un `almacen` (AlmacenSeries construido sobre `data`) se reutilizan su orden y sus
+    códigos de SKU, y las filas salen ordenadas por SKU y mes.
+    """
+    if almacen is not None:
+        result = data.iloc[almacen.orden]
+        codigos = almacen.codigos
+        valores = almacen.valores if columna == almacen.consumo_column else result[columna].to_numpy(dtype=float)
+    else:
+        data = data[data[grupo].notna()]
+        codigos, _ = pd.factorize(data[grupo], sort=True)
+
+        # Mismo orden que iterar el groupby: grupos ordenados y filas en su orden original
+        orden = np.argsort(codigos, kind='stable')
+        result = data.iloc[orden]
+        codigos = codigos[orden]
+        valores = result[columna].to_numpy(dtype=float)
+
+    # Calcular límites usando IQR
+    agrupado = pd.Series(valores).groupby(codigos)
+    Q1 = agrupado.quantile(0.25).to_numpy()[codigos]
+    Q3 = agrupado.quantile(0.75).to_numpy()[codigos]
+    IQR = Q3 - Q1
+    limite_inferior = Q1 - 1.5 * IQR
+    # limite_superior = Q3 + 1.5 * IQR
+
+    # Detectar outliers
+    #es_outlier = (valores < limite_inferior) | (valores > limite_superior)
+    es_outlier = valores < limite_inferior
+    # Reemplazar valores de consumo_tm para los outliers con el promedio de los datos no outliers
+    promedio_no_outliers = pd.Series(np.where(es_outlier, np.nan, valores)).groupby(codigos).transform('mean').to_numpy()
+
+    return result.assign(
+        es_outlier=es_outlier,
+        consumo_ajustado=np.where(es_outlier, promedio_no_outliers, valores)
+    )
+
+def analizar_tendencia_estacionalidad(df, sku_column, consumo_column, ventana=3, detalle=False, almacen=None):
+    """
+    Clasifica la variabilidad (CV), la tendencia (pendiente MCO) y la estacionalidad
+    (descomposición aditiva de periodo 12) de todos los SKUs a la vez, sobre la matriz
+    SKU×mes de un AlmacenSeries. Si no se entrega `almacen` se construye a partir de `df`;
+    si se entrega, sus valores deben corresponder a `consumo_column`.
+
+    Devuelve el DataFrame resumen; con `detalle=True` devuelve además el diccionario por SKU
+    de `detalle_tendencia_estacionalidad`, como (resultados_tendencia, resumen).
+    """
+    periodo = 12
+    if almacen is None:
+        almacen = AlmacenSeries(df, sku_column, consumo_column)
+    skus, largos = almacen.skus, almacen.largos
+    matriz = almacen.matriz(ancho_minimo=periodo + 1)
+    columnas = matriz.shape[1]
+    mascara = np.arange(columnas)[None, :] < largos[:, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calcular coeficiente de variación (CV)
+        media = np.where(mascara, matriz, 0).sum(axis=1) / largos
+        centrado = np.where(mascara, matriz - media[:, None], 0)
+        desviacion = np.sqrt((centrado ** 2).sum(axis=1) / largos)
+        cv = np.where(media != 0, desviacion / media, 0)
+        variabilidad = np.where(cv > 0.5, "Variable", "No Variable")
+
+        # Análisis de tendencia con regresión lineal (pendiente por mínimos cuadrados)
+        x = np.arange(columnas, dtype=float)
+        x_centrado = np.where(mascara, x[None, :] - ((largos - 1) / 2)[:, None], 0)
+        pendiente = (x_centrado * centrado).sum(axis=1) / (x_centrado ** 2).sum(axis=1)
+        tendencia = np.select([pendiente > 0, pendiente < 0], ["Ascendente", "Descendente"], "No Tiene Tendencia")
+
+        # Descomposición aditiva: tendencia con media móvil centrada 2x12
+        filtro = np.r_[0.5, np.ones(periodo - 1), 0.5] / periodo
+        mitad = periodo // 2
+        ventanas = np.lib.stride_tricks.sliding_window_view(matriz, len(filtro), axis=1)
+        tendencia_movil = np.full_like(matriz, np.nan)
+        tendencia_movil[:, mitad:columnas - mitad] = ventanas @ filtro
+        sin_tendencia = matriz - tendencia_movil
+
+        # Componente estacional: promedio por fase, centrado en cero
+        relleno = (-columnas) % periodo
+        fases = np.pad(sin_tendencia, ((0, 0), (0, relleno)), constant_values=np.nan).reshape(len(skus), -1, periodo)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            promedio_fase = np.nanmean(fases, axis=1)
+        promedio_fase -= promedio_fase.mean(axis=1, keepdims=True)
+        estacional = np.where(mascara, np.tile(promedio_fase, (1, columnas // periodo + 1))[:, :columnas], np.nan)
+        residuo = sin_tendencia - estacional
+
+        var_estacional = np.nanvar(np.where(mascara, estacional, np.nan), axis=1)
+        var_residuo = np.nanvar(residuo, axis=1)
+        # Varianzas al nivel del error de redondeo (series constantes o lineales) no son estacionalidad
+        ruido = np.finfo(float).eps * np.where(mascara, matriz ** 2, 0).sum(axis=1) / largos
+
+    # seasonal_decompose necesita dos ciclos completos y no admite valores faltantes
+    suficientes = (largos >= 2 * periodo) & ~np.any(mascara & np.isnan(matriz), axis=1)
+    estacionalidad = np.where(
+        suficientes,
+        np.where((var_estacional > var_residuo) & (var_estacional > ruido), "Estacional", "No Estacional"),
+        "Datos insuficientes")
+
+    # Crear el DataFrame resumen
+    df_resumen = pd.DataFrame({
+        'sku': skus,
+        'estacionalidad': estacionalidad,
+        'variabilidad': variabilidad,
+        'tendencia': tendencia
+    })
+
+    if detalle:
+        resultados_tendencia = detalle_tendencia_estacionalidad(df, sku_column, consumo_column, ventana)
+        return resultados_tendencia, df_resumen
+    return df_resumen
+
+def detalle_tendencia_estacionalidad(df, sku_column, consumo_column, ventana=3):
+    """
+    Análisis por SKU con la serie completa (media móvil) y el objeto de descomposición.
+    Es costoso; solo se usa cuando se pide el detalle en `analizar_tendencia_estacionalidad`.
+    """
+    # statsmodels y scipy se importan solo aquí: cargarlos toma más de un segundo
+    with warnings.catch_warnings():
+        # Al importarse statsmodels agrega filtros "always" para sus advertencias, que
+        # pasarían por delante del filtro 'ignore' global del servidor y de los workers
+        from statsmodels.tsa.seasonal import seasonal_decompose
+    from scipy.stats import linregress
+
     resultados_tendencia = {}
-    resumen = []
 
     for sku, datos_sku in df.groupby(sku_column):
         datos_sku = datos_sku.sort_values(by='mes_año').set_index('mes_año')
@@ -301,39 +419,335 @@ def analizar_tendencia_estacionalidad(df, sku_column, consumo_column, ventana=3)
             'descomposicion': descomposicion if estacionalidad == "Estacional" else None
         }
 
-        # Agregar a la lista para el DataFrame resumen
-        resumen.append({
-            'sku': sku,
-            'estacionalidad': estacionalidad,
-            'variabilidad': variabilidad,
-            'tendencia': tendencia
-        })
+    return resultados_tendencia
 
-    # Crear el DataFrame resumen
-    df_resumen = pd.DataFrame(resumen)
+# Configuración de los modelos evaluados; forma parte de la huella de la caché de pronósticos
+CONFIG_MODELOS = {
+    'SARIMA': {'order': (1, 1, 1), 'seasonal_order': (1, 1, 1, 12)},
+    'Holt-Winters': {'seasonal': 'add', 'seasonal_periods': 12},
+    'ARIMA': {'order': (1, 1, 1)},
+    'Regresión Lineal': {},
+}
+
+def error_absoluto_medio(reales, predichos):
+    """
+    MAE entre dos series del mismo largo. Como sklearn.metrics.mean_absolute_error, lanza
+    ValueError si los largos difieren o hay valores no finitos, y el modelo se descarta.
+    """
+    reales = np.asarray(reales, dtype=float)
+    predichos = np.asarray(predichos, dtype=float)
+    if reales.shape != predichos.shape:
+        raise ValueError(f"Largos distintos: {reales.shape} y {predichos.shape}")
+    if not (np.isfinite(reales).all() and np.isfinite(predichos).all()):
+        raise ValueError("La serie contiene valores faltantes o infinitos")
+    return float(np.average(np.abs(predichos - reales)))
+
+def regresion_lineal(valores):
+    """
+    Pendiente e intercepto de la recta de mínimos cuadrados de `valores` sobre sus posiciones
+    0..n-1. Se calcula como LinearRegression de scikit-learn (datos centrados y lstsq con el
+    mismo corte de valores singulares), así que da los mismos coeficientes.
+    """
+    y = np.asarray(valores, dtype=float)
+    if len(y) == 0 or not np.isfinite(y).all():
+        raise ValueError("La serie está vacía o contiene valores faltantes o infinitos")
+    x = np.arange(len(y), dtype=float)
+    x_media, y_media = x.mean(), y.mean()
+    corte = len(y) * np.finfo(float).eps
+    pendiente = np.linalg.lstsq((x - x_media)[:, None], y - y_media, rcond=corte)[0][0]
+    return pendiente, y_media - x_media * pendiente
+
+class TiempoExcedido(Exception):
+    """Se lanza desde el callback del optimizador cuando un ajuste supera su tiempo límite."""
+
+def _vigilante(fin):
+    # Callback para los optimizadores de statsmodels/scipy: aborta el ajuste al pasar `fin`
+    def callback(*args, **kwargs):
+        if time.time() > fin:
+            raise TiempoExcedido()
+    return callback
+
+def _pronosticar_serie(tarea, limite_modelo=None, limite_sku=None, fin_global=None):
+    """
+    Ajusta los modelos para una sola serie. Se ejecuta en los procesos del pool, por lo que
+    recibe solo arreglos numéricos (ordinales de los periodos y valores de consumo).
 
-    return resultados_tendencia, df_resumen
+    `limite_modelo` y `limite_sku` son segundos; `fin_global` es el instante (time.time())
+    en que termina el presupuesto total. Devuelve además la lista de modelos abandonados y
+    los ajustes realizados (ver `evaluar_modelos`).
+    """
+    ordinales, valores, pasos_pronostico = tarea
+    fines = [f for f in (time.time() + limite_sku if limite_sku else None, fin_global) if f is not None]
+    fin_sku = min(fines) if fines else None
+    consumo_tm = pd.Series(valores, index=pd.PeriodIndex.from_ordinals(ordinales, freq='M'))
+
+    # Dividir en entrenamiento y prueba
+    entrenamiento = consumo_tm[:-pasos_pronostico]
+    prueba = consumo_tm[-pasos_pronostico:]
+
+    # Evaluar todos los modelos y seleccionar el mejor
+    excedidos, ajustes = [], []
+    mejor_modelo, predicciones, evaluaciones = evaluar_modelos(
+        entrenamiento, prueba, pasos_pronostico, limite_modelo=limite_modelo, fin_sku=fin_sku, excedidos=excedidos, ajustes=ajustes)
+    predicciones = np.asarray(predicciones, dtype=float) if predicciones is not None else None
+    return mejor_modelo, predicciones, evaluaciones, excedidos, ajustes
+
+def _inicializar_worker():
+    # Los ajustes de statsmodels generan muchos ConvergenceWarning
+    warnings.filterwarnings('ignore')
+
+def ejecutar_pronosticos(tareas, workers=None, fin_global=None):
+    """
+    Ejecuta `_pronosticar_serie` sobre todas las tareas, repartidas en un pool de procesos
+    de `workers` procesos (FORECAST_WORKERS por defecto). Devuelve los resultados en el mismo
+    orden que las tareas; las tareas que no terminaron antes de `fin_global` devuelven None.
+
+    Al llegar `fin_global` los procesos del pool se terminan, de modo que un ajuste que no
+    respeta sus límites (por ejemplo dentro de la búsqueda inicial de Holt-Winters o de
+    SARIMAX) no retiene la carga. Por eso con un solo worker se ejecuta en el proceso actual
+    solo cuando no hay presupuesto global.
+    """
+    if not tareas:
+        return []
+    if fin_global is not None and time.time() >= fin_global:
+        return [None] * len(tareas)
+    workers = FORECAST_WORKERS if workers is None else workers
+    workers = max(1, min(workers, len(tareas)))
+    evaluar = partial(_pronosticar_serie, limite_modelo=FORECAST_MODEL_TIMEOUT or None,
+                      limite_sku=FORECAST_SKU_TIMEOUT or None, fin_global=fin_global)
+    if workers == 1 and fin_global is None:
+        return [evaluar(tarea) for tarea in tareas]
+
+    # 'spawn' evita hacer fork del proceso del servidor, que ya tiene hilos en ejecución
+    contexto = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=contexto, initializer=_inicializar_worker)
+    terminar = True
+    try:
+        futuros = [executor.submit(evaluar, tarea) for tarea in tareas]
+        _, en_curso = wait(futuros, timeout=None if fin_global is None else max(0, fin_global - time.time()))
+        resultados = [f.result() if f.done() and not f.cancelled() and f.exception() is None else None for f in futuros]
+        terminar = bool(en_curso)
+        return resultados
+    finally:
+        if terminar:
+            # Presupuesto agotado: se abandonan los ajustes en curso sin esperarlos
+            procesos = list((getattr(executor, '_processes', None) or {}).values())
+            executor.shutdown(wait=False, cancel_futures=True)
+            for proceso in procesos:
+                proceso.terminate()
+            for proceso in procesos:
+                proceso.join()
+        else:
+            executor.shutdown(wait=True)
+
+def evaluar_lineas_base(series, pasos_pronostico, periodo=12, ventana=3):
+    """
+    Evalúa modelos base baratos (ingenuo, ingenuo estacional, media móvil y tendencia lineal)
+    para todas las series a la vez. Las series se alinean a la derecha en una matriz SKU×mes
+    rellenada con NaN; las últimas `pasos_pronostico` columnas son el periodo de prueba.
 
-def generar_pronosticos(df_mensual, summary, pasos_pronostico=3):
+    Devuelve (mejor_nombre, mejor_mae, predicciones, evaluaciones) con una entrada por serie;
+    las predicciones son una matriz (series × pasos_pronostico).
+    """
+    largos = np.array([len(v) for v in series])
+    n_series, columnas = len(series), max(largos.max(initial=0), pasos_pronostico + 1)
+    matriz = np.full((n_series, columnas), np.nan)
+    for i, valores in enumerate(series):
+        if len(valores):
+            matriz[i, columnas - len(valores):] = valores
+
+    entrenamiento = matriz[:, :-pasos_pronostico]
+    prueba = matriz[:, -pasos_pronostico:]
+    n_entrenamiento = np.maximum(largos - pasos_pronostico, 0)
+    inicio_prueba = columnas - pasos_pronostico
+
+    with warnings.catch_warnings():
+        # Series sin datos de entrenamiento producen "Mean of empty slice"
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        # Ingenuo: repetir el último valor de entrenamiento
+        pred_ingenuo = np.repeat(entrenamiento[:, -1:], pasos_pronostico, axis=1)
+
+        # Ingenuo estacional: el valor del mismo mes del año anterior
+        pred_estacional = np.full((n_series, pasos_pronostico), np.nan)
+        for j in range(pasos_pronostico):
+            indice = inicio_prueba + j - periodo
+            pred_estacional[:, j] = matriz[:, indice] if indice < inicio_prueba else pred_estacional[:, j - periodo]
+        pred_estacional[n_entrenamiento < periodo] = np.nan
+
+        # Media móvil de los últimos `ventana` meses
+        pred_media = np.repeat(np.nanmean(entrenamiento[:, -ventana:], axis=1)[:, None], pasos_pronostico, axis=1)
+
+        # Tendencia lineal por mínimos cuadrados en forma cerrada
+        mascara = ~np.isnan(entrenamiento)
+        x = np.arange(entrenamiento.shape[1], dtype=float)
+        y = np.where(mascara, entrenamiento, 0.0)
+        n = mascara.sum(axis=1)
+        sx = (mascara * x).sum(axis=1)
+        sy = y.sum(axis=1)
+        sxx = (mascara * x ** 2).sum(axis=1)
+        sxy = (y * x).sum(axis=1)
+        denominador = n * sxx - sx ** 2
+        pendiente = np.divide(n * sxy - sx * sy, denominador, out=np.zeros(n_series), where=denominador > 0)
+        intercepto = (sy - pendiente * sx) / n
+        x_prueba = np.arange(inicio_prueba, columnas, dtype=float)
+        pred_lineal = intercepto[:, None] + pendiente[:, None] * x_prueba[None, :]
+
+        nombres = ['Ingenuo', 'Ingenuo Estacional', 'Media Móvil', 'Tendencia Lineal']
+        predicciones = np.stack([pred_ingenuo, pred_estacional, pred_media, pred_lineal])
+        maes = np.nanmean(np.abs(predicciones - prueba[None, :, :]), axis=2)
+
+    maes_validos = np.where(np.isnan(maes), np.inf, maes)
+    mejor = maes_validos.argmin(axis=0)
+    filas = np.arange(n_series)
+    mejor_mae = maes_validos[mejor, filas]
+    sin_modelo = np.isinf(mejor_mae)
+
+    mejor_nombre = [None if sin_modelo[i] else nombres[mejor[i]] for i in filas]
+    mejor_mae = np.where(sin_modelo, np.nan, mejor_mae)
+    mejores_predicciones = predicciones[mejor, filas]
+    evaluaciones = [
+        [(nombre, float(maes[k, i])) for k, nombre in enumerate(nombres) if not np.isnan(maes[k, i])]
+        for i in filas
+    ]
+    return mejor_nombre, mejor_mae, mejores_predicciones, evaluaciones
+
+def _evaluar_con_cache(skus, tareas, indices, workers, usar_cache, fin_global=None):
+    """
+    Evalúa los modelos completos para las series en `indices`, reutilizando los resultados
+    guardados de las series sin cambios. Devuelve {indice: (mejor_modelo, predicciones,
+    evaluaciones, excedidos, ajustes)}, con None para las series que no alcanzaron a evaluarse;
+    las series tomadas de la caché no tienen ajustes.
+    """
+    cache = leer_cache_pronosticos() if usar_cache else {}
+    huellas = {i: huella_serie(tareas[i][0], tareas[i][1], tareas[i][2], CONFIG_MODELOS) for i in indices}
+    salidas = {}
+    pendientes = []
+    for i in indices:
+        entrada = cache.get(str(skus[i]))
+        if entrada is not None and entrada['huella'] == huellas[i]:
+            salidas[i] = ((entrada['mejor_modelo'], entrada['mae']), entrada['predicciones'], entrada['evaluaciones'], [], [])
+        else:
+            pendientes.append(i)
+
+    # Evaluar todos los modelos y seleccionar el mejor para cada serie pendiente
+    for i, salida in zip(pendientes, ejecutar_pronosticos([tareas[i] for i in pendientes], workers, fin_global)):
+        salidas[i] = salida
+
+    if usar_cache and pendientes:
+        # Conservar las entradas de los SKUs vigentes que no se evaluaron en esta corrida
+        vigentes = {str(sku) for sku in skus}
+        entradas = {sku: entrada for sku, entrada in cache.items() if sku in vigentes}
+        for i, salida in salidas.items():
+            # Los ajustes abandonados por tiempo se vuelven a intentar en la siguiente corrida
+            if salida is None or salida[3]:
+                continue
+            mejor_modelo, predicciones, evaluaciones = salida[:3]
+            entradas[str(skus[i])] = {
+                'huella': huellas[i],
+                'mejor_modelo': mejor_modelo[0],
+                'mae': mejor_modelo[1],
+                'predicciones': predicciones,
+                'evaluaciones': evaluaciones,
+            }
+        guardar_cache_pronosticos(entradas)
+
+    return salidas
+
+def generar_pronosticos(df_mensual, summary, pasos_pronostico=3, workers=None, usar_cache=None, seleccion=None, almacen=None):
+    """
+    Genera los pronósticos por SKU leyendo cada serie del `almacen` (AlmacenSeries de
+    df_mensual, se construye si no se entrega). Con la caché de pronósticos activa solo se reajustan
+    los SKUs nuevos o cuya serie (o la configuración de modelos) cambió; para el resto se
+    reutilizan el mejor modelo, el MAE y las predicciones guardadas.
+
+    Con `seleccion='escalonado'` primero se evalúan modelos base para todas las series y solo
+    se ajustan Holt-Winters/ARIMA/SARIMA para las series con historia suficiente cuyo error
+    relativo supera FORECAST_ESCALATION_THRESHOLD. La columna 'nivel' de df_modelos indica
+    qué nivel ganó ('base' o 'avanzado').
+
+    Los ajustes que superan FORECAST_MODEL_TIMEOUT o FORECAST_SKU_TIMEOUT se abandonan y se
+    usa el mejor modelo terminado; al agotarse FORECAST_BUDGET las series restantes usan el
+    mejor modelo base. La columna 'tiempos_excedidos' lista los ajustes abandonados y 'ajustes'
+    el (modelo, segundos, resultado) de cada ajuste de la corrida.
+    """
+    fin_global = time.time() + FORECAST_BUDGET if FORECAST_BUDGET else None
+    usar_cache = FORECAST_CACHE if usar_cache is None else usar_cache
+    seleccion = FORECAST_SELECTION if seleccion is None else seleccion
     resultados = []
     pronosticos_finales = []
 
+    # Tomar las series de cada SKU del almacén como arreglos compactos
+    if almacen is None:
+        almacen = AlmacenSeries(df_mensual)
+    skus, bodegas, ultimos_periodos, tareas = [], [], [], []
     for sku in summary['sku']:
-        # Filtrar la serie histórica para el SKU
-        serie_historica = df_mensual[df_mensual['sku'] == sku].sort_values(by='mes_año')
-        serie_historica.set_index('mes_año', inplace=True)
-        consumo_tm = serie_historica['consumo_tm']
-
-        # Dividir en entrenamiento y prueba
-        entrenamiento = consumo_tm[:-pasos_pronostico]
-        prueba = consumo_tm[-pasos_pronostico:]
-
-        # Evaluar todos los modelos y seleccionar el mejor
-        mejor_modelo, predicciones, evaluaciones = evaluar_modelos(entrenamiento, prueba, pasos_pronostico)
-        bodega = serie_historica['bodega'].iloc[0] 
+        ordinales, valores, bodega = almacen.serie(sku)
+        skus.append(sku)
+        bodegas.append(bodega)
+        ultimos_periodos.append(pd.Period(ordinal=int(ordinales[-1]), freq='M'))
+        tareas.append((ordinales, valores, pasos_pronostico))
+
+    escalonado = seleccion == 'escalonado'
+    if escalonado:
+        # Nivel 1: modelos base vectorizados para todas las series
+        nombres_base, maes_base, predicciones_base, evaluaciones_base = evaluar_lineas_base(
+            [valores for _, valores, _ in tareas], pasos_pronostico)
+        escalar = []
+        for i, (_, valores, _) in enumerate(tareas):
+            prueba = valores[-pasos_pronostico:]
+            nivel_prueba = np.mean(np.abs(prueba)) if len(prueba) else 0
+            error_relativo = maes_base[i] / nivel_prueba if nivel_prueba > 0 else (np.inf if maes_base[i] > 0 else 0)
+            if len(valores) - pasos_pronostico >= FORECAST_MIN_HISTORY and not error_relativo <= FORECAST_ESCALATION_THRESHOLD:
+                escalar.append(i)
+    else:
+        escalar = list(range(len(tareas)))
+
+    # Nivel 2: modelos completos (todas las series, o solo las escaladas)
+    avanzados = _evaluar_con_cache(skus, tareas, escalar, workers, usar_cache, fin_global)
+
+    # Las series sin ningún modelo completo terminado a tiempo usan el mejor modelo base
+    sin_terminar = {i for i, salida in avanzados.items() if salida is None or (salida[0][0] is None and salida[3])}
+    if sin_terminar and not escalonado:
+        nombres_base, maes_base, predicciones_base, evaluaciones_base = [None] * len(tareas), [np.nan] * len(tareas), [None] * len(tareas), [[]] * len(tareas)
+        indices_base = sorted(sin_terminar)
+        resultado_base = evaluar_lineas_base([tareas[i][1] for i in indices_base], pasos_pronostico)
+        for k, i in enumerate(indices_base):
+            nombres_base[i], maes_base[i], predicciones_base[i], evaluaciones_base[i] = (parte[k] for parte in resultado_base)
+
+    salidas, niveles = [], []
+    for i in range(len(tareas)):
+        salida = avanzados.get(i)
+        if salida is not None and i not in sin_terminar:
+            mejor_modelo, predicciones, evaluaciones, excedidos = salida[:4]
+            nivel = 'avanzado'
+        else:
+            mejor_modelo, predicciones, evaluaciones, excedidos = (None, None), None, [], []
+            nivel = 'base'
+            if salida is not None:
+                evaluaciones, excedidos = salida[2], salida[3]
+            elif i in avanzados:
+                excedidos = ['presupuesto global']
+        if escalonado or i in sin_terminar:
+            # Comparar contra el mejor modelo base
+            mejor_base = (nombres_base[i], None if np.isnan(maes_base[i]) else float(maes_base[i]))
+            evaluaciones = evaluaciones_base[i] + evaluaciones
+            if mejor_base[0] is not None and (mejor_modelo[0] is None or mejor_base[1] <= mejor_modelo[1]):
+                mejor_modelo, predicciones, nivel = mejor_base, predicciones_base[i], 'base'
+        salidas.append((mejor_modelo, predicciones, evaluaciones, excedidos))
+        niveles.append(nivel)
+
+    con_excedidos = sum(1 for salida in salidas if salida[3])
+    if con_excedidos:
+        logger.warning(f"{con_excedidos} SKUs con ajustes abandonados por tiempo límite")
+
+    # Tiempo y resultado de cada ajuste de los modelos completos, por serie
+    ajustes = [avanzados[i][4] if avanzados.get(i) is not None else [] for i in range(len(tareas))]
+
+    for sku, bodega, ultimo_periodo, nivel, ajustes_sku, (mejor_modelo, predicciones, evaluaciones, excedidos) in zip(skus, bodegas, ultimos_periodos, niveles, ajustes, salidas):
         # Agregar predicciones al DataFrame final
         for i in range(pasos_pronostico):
-            nueva_fecha = consumo_tm.index[-1].to_timestamp() + pd.DateOffset(months=i+1)
+            nueva_fecha = ultimo_periodo.to_timestamp() + pd.DateOffset(months=i+1)
             valor_pronosticado = predicciones[i] if predicciones is not None else np.nan
             pronosticos_finales.append({
                 'mes_año': nueva_fecha,
@@ -344,14 +758,15 @@ def generar_pronosticos(df_mensual, summary, pasos_pronostico=3):
             })
 
         # Guardar los resultados del modelo y errores
-       
-
         resultados.append({
             'sku': sku,
             'bodega': bodega,
             'mejor_modelo': mejor_modelo[0],
             'mae': mejor_modelo[1],
-            'evaluaciones': evaluaciones
+            'nivel': nivel,
+            'evaluaciones': evaluaciones,
+            'tiempos_excedidos': excedidos,
+            'ajustes': ajustes_sku
         })
 
     # Crear DataFrames finales
@@ -360,71 +775,99 @@ def generar_pronosticos(df_mensual, summary, pasos_pronostico=3):
 
     return df_pronosticos, df_modelos
 
-def evaluar_modelos(serie_entrenamiento, serie_prueba, pasos_pronostico):
+def evaluar_modelos(serie_entrenamiento, serie_prueba, pasos_pronostico, limite_modelo=None, fin_sku=None, excedidos=None, ajustes=None):
     """
     Prueba diferentes modelos de pronóstico y selecciona el mejor según MAE en la prueba.
+
+    `limite_modelo` (segundos por modelo) y `fin_sku` (instante límite para toda la serie)
+    acotan los ajustes iterativos; un ajuste que los supera se abandona y su nombre se
+    agrega a `excedidos`. A `ajustes` se agrega (modelo, segundos, resultado) por cada
+    modelo, con resultado 'ok', 'timeout' o 'error'.
     """
+    # statsmodels solo se carga al ajustar el primer modelo (en cada proceso del pool);
+    # sin sus filtros "always", como en `detalle_tendencia_estacionalidad`
+    with warnings.catch_warnings():
+        from statsmodels.tsa.statespace.sarimax import SARIMAX
+        from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
     resultados_modelos = []
     predicciones_modelos = {}
+    excedidos = [] if excedidos is None else excedidos
+    ajustes = [] if ajustes is None else ajustes
+
+    def registrar(modelo, inicio, resultado):
+        ajustes.append((modelo, round(time.perf_counter() - inicio, 4), resultado))
+
+    def callback_limite():
+        # Callback que aborta el ajuste actual al pasar su límite (None si no hay límite)
+        fines = [f for f in (time.time() + limite_modelo if limite_modelo else None, fin_sku) if f is not None]
+        if not fines:
+            return None
+        if time.time() >= min(fines):
+            raise TiempoExcedido()
+        return _vigilante(min(fines))
 
     # Modelo 1: SARIMA
+    inicio = time.perf_counter()
     try:
-        sarima = SARIMAX(serie_entrenamiento, order=(1, 1, 1), seasonal_order=(1, 1, 1, 12)).fit(disp=False)
+        sarima = SARIMAX(serie_entrenamiento, **CONFIG_MODELOS['SARIMA']).fit(disp=False, callback=callback_limite())
         pred_sarima = sarima.get_forecast(steps=pasos_pronostico).predicted_mean
-        mae_sarima = mean_absolute_error(serie_prueba, pred_sarima[:len(serie_prueba)])
+        mae_sarima = error_absoluto_medio(serie_prueba, pred_sarima[:len(serie_prueba)])
         resultados_modelos.append(('SARIMA', mae_sarima))
         predicciones_modelos['SARIMA'] = pred_sarima
-    except:
-        pass
+        registrar('SARIMA', inicio, 'ok')
+    except TiempoExcedido:
+        excedidos.append('SARIMA')
+        registrar('SARIMA', inicio, 'timeout')
+    except Exception:
+        registrar('SARIMA', inicio, 'error')
 
     # Modelo 2: Holt-Winters
+    inicio = time.perf_counter()
     try:
-        hw = ExponentialSmoothing(serie_entrenamiento, seasonal='add', seasonal_periods=12).fit()
+        callback = callback_limite()
+        hw = ExponentialSmoothing(serie_entrenamiento, **CONFIG_MODELOS['Holt-Winters']).fit(
+            minimize_kwargs=None if callback is None else {'callback': callback})
         pred_hw = hw.forecast(steps=pasos_pronostico)
-        mae_hw = mean_absolute_error(serie_prueba, pred_hw[:len(serie_prueba)])
+        mae_hw = error_absoluto_medio(serie_prueba, pred_hw[:len(serie_prueba)])
         resultados_modelos.append(('Holt-Winters', mae_hw))
         predicciones_modelos['Holt-Winters'] = pred_hw
-    except:
-        pass
+        registrar('Holt-Winters', inicio, 'ok')
+    except TiempoExcedido:
+        excedidos.append('Holt-Winters')
+        registrar('Holt-Winters', inicio, 'timeout')
+    except Exception:
+        registrar('Holt-Winters', inicio, 'error')
 
     # Modelo 3: ARIMA
+    inicio = time.perf_counter()
     try:
-        arima = SARIMAX(serie_entrenamiento, order=(1, 1, 1)).fit(disp=False)
+        arima = SARIMAX(serie_entrenamiento, **CONFIG_MODELOS['ARIMA']).fit(disp=False, callback=callback_limite())
         pred_arima = arima.get_forecast(steps=pasos_pronostico).predicted_mean
-        mae_arima = mean_absolute_error(serie_prueba, pred_arima[:len(serie_prueba)])
+        mae_arima = error_absoluto_medio(serie_prueba, pred_arima[:len(serie_prueba)])
         resultados_modelos.append(('ARIMA', mae_arima))
         predicciones_modelos['ARIMA'] = pred_arima
-    except:
-        pass
-
-    # Modelo 4: Regresión Lineal
+        registrar('ARIMA', inicio, 'ok')
+    except TiempoExcedido:
+        excedidos.append('ARIMA')
+        registrar('ARIMA', inicio, 'timeout')
+    except Exception:
+        registrar('ARIMA', inicio, 'error')
+
+    # Modelo 4: Regresión Lineal (forma cerrada, no necesita límite de tiempo)
+    inicio = time.perf_counter()
     try:
-        x = np.arange(len(serie_entrenamiento)).reshape(-1, 1)
-        y = serie_entrenamiento.values
-        reg = LinearRegression().fit(x, y)
-        x_future = np.arange(len(serie_entrenamiento), len(serie_entrenamiento) + pasos_pronostico).reshape(-1, 1)
-        pred_lr = reg.predict(x_future)
-        mae_lr = mean_absolute_error(serie_prueba, reg.predict(np.arange(len(serie_entrenamiento)-len(serie_prueba), len(serie_entrenamiento)).reshape(-1, 1)))
+        pendiente, intercepto = regresion_lineal(serie_entrenamiento.values)
+        x_future = np.arange(len(serie_entrenamiento), len(serie_entrenamiento) + pasos_pronostico)
+        pred_lr = x_future * pendiente + intercepto
+        mae_lr = error_absoluto_medio(serie_prueba, np.arange(len(serie_entrenamiento)-len(serie_prueba), len(serie_entrenamiento)) * pendiente + intercepto)
         resultados_modelos.append(('Regresión Lineal', mae_lr))
         predicciones_modelos['Regresión Lineal'] = pred_lr
-    except:
-        pass
+        registrar('Regresión Lineal', inicio, 'ok')
+    except Exception:
+        registrar('Regresión Lineal', inicio, 'error')
 
-    # Seleccionar el mejor modelo
+    # Seleccionar el mejor modelo entre los que terminaron
     mejor_modelo = min(resultados_modelos, key=lambda x: x[1]) if resultados_modelos else (None, None)
 
     return mejor_modelo, predicciones_modelos.get(mejor_modelo[0], None), resultados_modelos
-
-# Calcular si se debe solicitar según la política de inventario
-def generar_pedido(row):
-    if row['politica'] == 'EOQ':
-        # Si el inventario total está por debajo del punto de reorden (R)
-        if row['inventario_total'] < row['R']:
-            return row['EOQ']  # Pedido por EOQ
-        else:
-            return 0  # No se necesita pedido
-    elif row['politica'] == 'Revisión Periódica':
-        # Pedido para alcanzar el nivel objetivo
-        return max(row['nivel_objetivo'] - row['inventario_total'], 0)
-    else:
-        return 0  # No se aplica ninguna política